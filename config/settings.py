@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 import cloudinary
 import cloudinary.uploader
@@ -154,6 +155,104 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'nahbah', 'media')
 
+# Widths in pixels of the preview variants stored for each design (run backfill_previews after changing them)
+DESIGN_PREVIEW_WIDTHS = {'thumbnail': 200, 'medium': 600, 'large': 1200}
+
+# Design list page size (?page_size= can change it up to the maximum)
+DESIGN_LIST_PAGE_SIZE = int(os.getenv('DESIGN_LIST_PAGE_SIZE', '24'))
+DESIGN_LIST_MAX_PAGE_SIZE = 100
+# Text search configuration of the design search vectors ("simple" doesn't stem, which suits mixed languages)
+DESIGN_SEARCH_CONFIG = os.getenv('DESIGN_SEARCH_CONFIG', 'simple')
+# Designs accepted by one batch submission (DesignViewSet.batch)
+DESIGN_BATCH_MAX_SIZE = int(os.getenv('DESIGN_BATCH_MAX_SIZE', '100'))
+
+# Booklet generation
+# Number of design files downloaded in parallel while building a booklet
+BOOKLET_FETCH_CONCURRENCY = int(os.getenv('BOOKLET_FETCH_CONCURRENCY', '8'))
+# Seconds to wait for a connection to Cloudinary, and for a design file download
+# (between two reads and in total per attempt) before rendering the error page instead
+BOOKLET_FETCH_CONNECT_TIMEOUT = float(os.getenv('BOOKLET_FETCH_CONNECT_TIMEOUT', '5'))
+BOOKLET_FETCH_TIMEOUT = float(os.getenv('BOOKLET_FETCH_TIMEOUT', '20'))
+# Retries of failed downloads (connection errors, timeouts, 5xx/429), after a random
+# delay of up to BACKOFF * 2^attempt seconds
+BOOKLET_FETCH_RETRIES = int(os.getenv('BOOKLET_FETCH_RETRIES', '2'))
+BOOKLET_FETCH_RETRY_BACKOFF = float(os.getenv('BOOKLET_FETCH_RETRY_BACKOFF', '0.5'))
+# Design files larger than this many bytes are rejected
+BOOKLET_FETCH_MAX_SIZE = int(os.getenv('BOOKLET_FETCH_MAX_SIZE', 100 * 1024 * 1024))
+# Stop fetching from a host after FAILURE_THRESHOLD failures in a row and try again after RESET_TIMEOUT seconds
+BOOKLET_FETCH_BREAKER = {
+    'FAILURE_THRESHOLD': int(os.getenv('BOOKLET_FETCH_BREAKER_THRESHOLD', '5')),
+    'RESET_TIMEOUT': float(os.getenv('BOOKLET_FETCH_BREAKER_RESET', '30')),
+}
+# Local directory for booklet caches (ephemeral storage is fine, everything can be rebuilt)
+BOOKLET_CACHE_DIR = os.getenv('BOOKLET_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nahbah'))
+# Rendered per-design booklet fragments
+BOOKLET_FRAGMENT_CACHE = {
+    'BACKEND': 'nahbah.utils.fragment_cache.DiskFragmentCache',
+    'LOCATION': os.path.join(BOOKLET_CACHE_DIR, 'fragments'),
+    'MAX_SIZE': int(os.getenv('BOOKLET_FRAGMENT_CACHE_MAX_SIZE', 256 * 1024 * 1024)),
+}
+# Design file bytes downloaded from Cloudinary
+DESIGN_FILE_CACHE = {
+    'LOCATION': os.path.join(BOOKLET_CACHE_DIR, 'files'),
+    'MAX_SIZE': int(os.getenv('DESIGN_FILE_CACHE_MAX_SIZE', 1024 * 1024 * 1024)),
+}
+# Finished booklets, keyed by the set of approved design ids
+BOOKLET_RESULT_CACHE = {
+    'LOCATION': os.path.join(BOOKLET_CACHE_DIR, 'booklets'),
+    'MAX_SIZE': int(os.getenv('BOOKLET_RESULT_CACHE_MAX_SIZE', 512 * 1024 * 1024)),
+}
+# Cached responses of the read-only catalog endpoints (nahbah/utils/response_cache.py). The file-based
+# backend is shared by all worker processes on the machine, so invalidations made by one reach the others
+RESPONSE_CACHE_ALIAS = 'responses'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    RESPONSE_CACHE_ALIAS: {
+        'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.path.join(BOOKLET_CACHE_DIR, 'responses'),
+        'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', 24 * 60 * 60)),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))},
+    },
+}
+# Booklet renders allowed at the same time across all worker processes on this machine (0 for no limit);
+# further download_booklet requests get 429 with Retry-After: BOOKLET_RETRY_AFTER seconds
+BOOKLET_MAX_CONCURRENT_RENDERS = int(os.getenv('BOOKLET_MAX_CONCURRENT_RENDERS', '2'))
+BOOKLET_RETRY_AFTER = int(os.getenv('BOOKLET_RETRY_AFTER', '10'))
+# Seconds a request waits for an identical booklet that is already being rendered
+BOOKLET_SINGLE_FLIGHT_TIMEOUT = int(os.getenv('BOOKLET_SINGLE_FLIGHT_TIMEOUT', '60'))
+BOOKLET_LOCK_DIR = os.path.join(BOOKLET_CACHE_DIR, 'locks')
+# Booklet of all approved designs, updated incrementally when designs change
+MASTER_BOOKLET_DIR = os.path.join(BOOKLET_CACHE_DIR, 'master')
+# Background booklet jobs: worker threads per process, output directory, seconds a job
+# may wait in the queue and may run before it is considered lost, seconds finished jobs are kept
+BOOKLET_JOB_WORKERS = int(os.getenv('BOOKLET_JOB_WORKERS', '2'))
+BOOKLET_JOB_DIR = os.path.join(BOOKLET_CACHE_DIR, 'jobs')
+BOOKLET_JOB_QUEUE_TIMEOUT = int(os.getenv('BOOKLET_JOB_QUEUE_TIMEOUT', '600'))
+BOOKLET_JOB_TIMEOUT = int(os.getenv('BOOKLET_JOB_TIMEOUT', '600'))
+BOOKLET_JOB_RETENTION = int(os.getenv('BOOKLET_JOB_RETENTION', 24 * 60 * 60))
+# Worker threads per process for background refreshes: pre-rendering approved designs
+# and building the master booklet. Booklet jobs don't wait behind them.
+BOOKLET_REFRESH_WORKERS = int(os.getenv('BOOKLET_REFRESH_WORKERS', '1'))
+# Processes rendering design pages in parallel when a booklet is built, 0 renders them in the serving process
+BOOKLET_RENDER_WORKERS = int(os.getenv('BOOKLET_RENDER_WORKERS', '0'))
+# Render the booklet fragment of a design in the background as soon as it is approved
+BOOKLET_PRERENDER = os.getenv('BOOKLET_PRERENDER', 'True').lower() in ['true', '1', 'yes']
+# QR codes are drawn as "vector" shapes (crisp, small) or embedded as "raster" PNG images
+BOOKLET_QR_MODE = os.getenv('BOOKLET_QR_MODE', 'vector')
+# Number of generated QR codes memoized per process
+BOOKLET_QR_CACHE_SIZE = 1024
+# Design images larger than needed for print are downscaled to DPI and recompressed at QUALITY
+BOOKLET_IMAGE_PROFILE = {
+    'DPI': int(os.getenv('BOOKLET_IMAGE_DPI', '200')),
+    'QUALITY': int(os.getenv('BOOKLET_IMAGE_QUALITY', '80')),
+}
+# Booklet PDF save options: "fast" saves quicker, "smallest" produces the smallest file
+BOOKLET_SAVE_PROFILE = os.getenv('BOOKLET_SAVE_PROFILE', 'smallest')
+# Bump when the booklet layout changes so previously cached booklets are not served
+BOOKLET_CATALOG_VERSION = 1
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -179,7 +278,13 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'range',
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
 ]
+# Let browser clients resume booklet downloads and revalidate catalog responses
+CORS_EXPOSE_HEADERS = ['accept-ranges', 'content-disposition', 'content-range', 'etag', 'last-modified']
 
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:5173",
@@ -15,3 +15,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+
+# Prepare the static booklet pages (intro and credits) once per worker instead of per request
+from nahbah.utils.generate_booklet import prepare_static_pages  # noqa: E402
+
+prepare_static_pages()
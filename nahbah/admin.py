@@ -2,12 +2,13 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.contrib import messages
+from django.db.models import Q
 from django.http import HttpResponseRedirect
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
 from config import settings
-from .models import Design, Contributor, Material
+from .models import BookletJob, Design, Contributor, Material
 import os
 
 
@@ -124,7 +125,7 @@ class DesignAdmin(ImportExportModelAdmin):
 
     def image_thumbnail(self, obj):
         """Display small thumbnail of design preview image"""
-        preview_url = obj.get_preview_url()
+        preview_url = obj.preview_variants.get('thumbnail') or obj.preview_url
         if preview_url:
             return format_html(
                 '<img src="{}" style="max-height: 50px; max-width: 100px;" />',
@@ -166,6 +167,19 @@ class DesignAdmin(ImportExportModelAdmin):
         """Optimize queries"""
         return super().get_queryset(request).select_related('contributor', 'material')
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        On PostgreSQL, search title, description and material through the same
+        full text index as the API, plus contributor name and email.
+        """
+        if not search_term or not queryset.uses_full_text_search():
+            return super().get_search_results(request, queryset, search_term)
+        # Contributor ids are looked up first (a small table) so the planner can combine both indexes
+        contributor_ids = list(Contributor.objects.filter(
+            Q(name__icontains=search_term) | Q(email__icontains=search_term)
+        ).values_list('id', flat=True))
+        return queryset.matching(search_term) | queryset.filter(contributor_id__in=contributor_ids), False
+
 
 @admin.register(Contributor)
 class ContributorAdmin(ImportExportModelAdmin):
@@ -252,6 +266,22 @@ class MaterialAdmin(ImportExportModelAdmin):
     design_count.short_description = 'Used in Designs'
 
 
+@admin.register(BookletJob)
+class BookletJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'design_count', 'created_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = [field.name for field in BookletJob._meta.fields]
+
+    def design_count(self, obj):
+        """Number of designs in the booklet"""
+        return len(obj.design_ids)
+
+    design_count.short_description = 'Designs'
+
+    def has_add_permission(self, request):
+        return False
+
+
 # Customize admin site
 admin.site.site_header = "NOT A HOUSE BUT A HOME - Admin"
 admin.site.site_title = "NOT A HOUSE BUT A HOME - Admin"
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from nahbah.models import PREVIEW_FIELDS, Design
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the preview URL and sized preview variants of designs saved before they were persisted. "
+        "Use --all to rebuild every design, e.g. after changing DESIGN_PREVIEW_WIDTHS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild the previews of every design.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Designs updated per query.")
+
+    def handle(self, *args, **options):
+        designs = Design.objects.order_by("id").only("id", "design_file", "preview_image", *PREVIEW_FIELDS)
+        if not options["all"]:
+            designs = designs.filter(preview_url="")
+
+        batch = []
+        updated = []
+        for design in designs.iterator(chunk_size=options["batch_size"]):
+            design.refresh_previews()
+            batch.append(design)
+            if len(batch) >= options["batch_size"]:
+                updated += self.save_batch(batch)
+                batch = []
+        updated += self.save_batch(batch)
+        self.stdout.write(self.style.SUCCESS(f"Stored previews of {len(updated)} designs."))
+
+    @staticmethod
+    def save_batch(batch):
+        if batch:
+            # bulk_update skips save() but goes through DesignQuerySet.update(), which sends
+            # designs_updated for the batch: the previews are part of the design API responses
+            Design.objects.bulk_update(batch, list(PREVIEW_FIELDS))
+        return [design.id for design in batch]
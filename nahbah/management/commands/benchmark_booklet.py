@@ -0,0 +1,218 @@
+import json
+import os
+import platform
+import resource
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import cloudinary
+import fitz  # PyMuPDF
+from PIL import Image
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from nahbah.models import Contributor, Design, Material
+from nahbah.utils import file_cache, fragment_cache
+from nahbah.utils.generate_booklet import generate_booklet
+from nahbah.utils.render_pool import get_render_pool
+
+
+def make_pdf(pages):
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page(width=420, height=298)
+        page.insert_textbox(fitz.Rect(30, 30, 390, 268), f"Benchmark design page {number + 1}\n" + "lorem ipsum " * 60,
+                            fontsize=9, fontname="helv")
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def make_jpeg(width, height):
+    # Noise compresses like a photo, a flat colour would not
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    stream = BytesIO()
+    img.save(stream, format="JPEG", quality=90)
+    return stream.getvalue()
+
+
+class CloudinaryStandIn:
+    """
+    A local HTTP server answering Cloudinary delivery URLs with fixture files.
+    PDF public ids get the PDF fixture, everything else the JPEG fixture.
+    """
+
+    def __init__(self, pdf, jpeg, latency):
+        files = {"pdf": pdf, "jpg": jpeg}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency)
+                body = files["pdf"] if self.path.endswith(".pdf") else files["jpg"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf" if self.path.endswith(".pdf") else "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        host, port = self.server.server_address
+        cloudinary.config(cloud_name="benchmark", cname=f"{host}:{port}", secure=False, private_cdn=False)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_render_pool():
+    """Start every render worker up front so process start-up is not part of the first run."""
+    render_pool = get_render_pool()
+    if render_pool is not None:
+        list(render_pool.map(time.sleep, [0.2] * settings.BOOKLET_RENDER_WORKERS))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark generate_booklet against a local Cloudinary stand-in, in a throwaway test database. "
+        "Reports wall time, per-stage timings, peak RSS (of this process, sizes run in ascending order), "
+        "output size and the speedup of each render worker count over the first, and writes the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1,10,50,200", help="Comma-separated numbers of designs per booklet.")
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per size; the fastest run is reported.")
+        parser.add_argument("--latency", type=float, default=50, help="Stand-in response latency in milliseconds.")
+        parser.add_argument("--pdf-pages", type=int, default=2, help="Pages of the fixture design PDF.")
+        parser.add_argument("--image-size", default="3000x2000", help="Pixel size of the fixture design JPEG.")
+        parser.add_argument("--warm", action="store_true",
+                            help="Keep the fragment and design file caches between runs.")
+        parser.add_argument("--workers", default="0",
+                            help="Comma-separated BOOKLET_RENDER_WORKERS values to compare, e.g. 0,1,2,4.")
+        parser.add_argument("--output", default="booklet_benchmark.json", help="Where to write the JSON results.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options["sizes"].split(","))
+            worker_counts = [int(workers) for workers in options["workers"].split(",")]
+            width, height = (int(value) for value in options["image_size"].lower().split("x"))
+        except ValueError:
+            raise CommandError("--sizes and --workers must be numbers and --image-size WIDTHxHEIGHT.")
+
+        pdf = make_pdf(options["pdf_pages"])
+        jpeg = make_jpeg(width, height)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir, CloudinaryStandIn(pdf, jpeg, options["latency"] / 1000):
+                runs = self.run_benchmark(sizes, worker_counts, options, cache_dir)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "environment": {
+                "python": platform.python_version(),
+                "pymupdf": fitz.VersionBind,
+                "platform": platform.platform(),
+            },
+            "parameters": {
+                "latency_ms": options["latency"],
+                "pdf_pages": options["pdf_pages"],
+                "pdf_bytes": len(pdf),
+                "image_size": [width, height],
+                "image_bytes": len(jpeg),
+                "repeat": options["repeat"],
+                "warm": options["warm"],
+                "cpu_count": os.cpu_count(),
+            },
+            "runs": runs,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run_benchmark(self, sizes, worker_counts, options, cache_dir):
+        material = Material.objects.create(name="Benchmark material")
+        contributor = Contributor.objects.create(name="Benchmark contributor", email="benchmark@example.com")
+        designs = [
+            Design(
+                title=f"Benchmark design {number}",
+                description="A benchmark design description. " * 20,
+                material=material,
+                contributor=contributor,
+                design_file=f"image/upload/v1/benchmark_{number}.{'pdf' if number % 2 else 'jpg'}",
+                status="approved",
+            )
+            for number in range(max(sizes))
+        ]
+        design_ids = [design.id for design in Design.objects.bulk_create(designs)]
+
+        cache_settings = {"BACKEND": "nahbah.utils.fragment_cache.DummyFragmentCache"}
+        if options["warm"]:
+            cache_settings = {
+                "BACKEND": "nahbah.utils.fragment_cache.DiskFragmentCache",
+                "LOCATION": os.path.join(cache_dir, "fragments"),
+                "MAX_SIZE": 1024 ** 3,
+            }
+        file_cache_settings = {"LOCATION": os.path.join(cache_dir, "files"), "MAX_SIZE": 1024 ** 3}
+
+        runs = []
+        with override_settings(BOOKLET_FRAGMENT_CACHE=cache_settings, DESIGN_FILE_CACHE=file_cache_settings):
+            fragment_cache._fragment_cache = None
+            file_cache._design_file_cache = None
+            for workers in worker_counts:
+                with override_settings(BOOKLET_RENDER_WORKERS=workers):
+                    start_render_pool()
+                    for size in sizes:
+                        runs.append(self.run_size(design_ids[:size], workers, options, cache_dir))
+            fragment_cache._fragment_cache = None
+            file_cache._design_file_cache = None
+
+        # Speedup of each worker count over the first one, per booklet size
+        baselines = {}
+        for run in runs:
+            baselines.setdefault(run["designs"], run["wall_time"])
+            run["speedup"] = baselines[run["designs"]] / run["wall_time"]
+        return runs
+
+    def run_size(self, design_ids, workers, options, cache_dir):
+        best = None
+        for _ in range(options["repeat"]):
+            if not options["warm"]:
+                file_cache.get_design_file_cache().store.clear()
+            stats = {}
+            start = time.perf_counter()
+            output_path = generate_booklet(design_ids, stats=stats, output=os.path.join(cache_dir, "booklet.pdf"))
+            wall_time = time.perf_counter() - start
+            if best is None or wall_time < best["wall_time"]:
+                best = {
+                    "designs": len(design_ids),
+                    "workers": workers,
+                    "wall_time": wall_time,
+                    "timings": stats["timings"],
+                    "output_bytes": os.path.getsize(output_path),
+                    "failed_designs": len(stats["failed_design_ids"]),
+                }
+        best["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f"{best['designs']:>5} designs  {workers:>2} workers  {best['wall_time']:8.2f}s  "
+            f"{best['output_bytes'] / 1024 / 1024:8.2f} MB  peak RSS {best['peak_rss_kb'] / 1024:7.1f} MB  "
+            + "  ".join(f"{stage} {seconds:.2f}s" for stage, seconds in best["timings"].items())
+        )
+        return best
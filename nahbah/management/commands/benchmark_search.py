@@ -0,0 +1,144 @@
+import json
+import platform
+import random
+import statistics
+import time
+
+from django.contrib.admin.sites import site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from nahbah.models import Contributor, Design, Material
+
+# Filler words; "bamboo" and "insulation" are planted at known frequencies below
+WORDS = (
+    "wall roof floor window door frame panel brick beam column shelter house home module kit modular "
+    "straw clay earth stone timber plank board sheet panel joint bolt screw nail rope tarp canvas tent "
+    "warm dry light strong cheap quick simple local reusable recycled salvaged durable portable flat "
+    "build assemble cut fold stack tie lift seal cover insulate ventilate shade drain anchor repair"
+).split()
+QUERIES = {
+    "rare word (0.1% of designs)": "bamboo",
+    "common word (10% of designs)": "insulation",
+    "two words": "timber roof",
+    "phrase": '"straw wall"',
+}
+
+
+def sentence(rng, words):
+    return " ".join(rng.choices(WORDS, k=words))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark design search in a throwaway test database: the full text search of the API and admin "
+        "against the icontains scan the admin used before, and write the results as JSON. "
+        "Full text search needs PostgreSQL; on other databases both sides use icontains."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--designs", type=int, default=100000, help="Number of designs to search.")
+        parser.add_argument("--repeat", type=int, default=20,
+                            help="Runs per query (first page plus count, as the search endpoint); "
+                                 "median and p95 are reported.")
+        parser.add_argument("--page-size", type=int, default=24, help="Results fetched per query.")
+        parser.add_argument("--output", default="search_benchmark.json", help="Where to write the JSON results.")
+
+    def handle(self, *args, **options):
+        if options["designs"] < 1000:
+            raise CommandError("--designs must be at least 1000.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.create_designs(options["designs"])
+            runs = {label: self.run_query(terms, options) for label, terms in QUERIES.items()}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "environment": {
+                "python": platform.python_version(),
+                "database": connection.vendor,
+                "platform": platform.platform(),
+            },
+            "parameters": {
+                "designs": options["designs"],
+                "repeat": options["repeat"],
+                "page_size": options["page_size"],
+                "full_text_search": Design.objects.uses_full_text_search(),
+            },
+            "runs": runs,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def create_designs(self, count):
+        rng = random.Random(0)
+        started = time.perf_counter()
+        materials = Material.objects.bulk_create([
+            Material(name=f"{word} {number}") for number, word in enumerate(rng.sample(WORDS, 20))
+        ])
+        contributors = Contributor.objects.bulk_create([
+            Contributor(name=f"Contributor {number}", email=f"contributor{number}@example.com")
+            for number in range(500)
+        ])
+        for start in range(0, count, 5000):
+            batch = []
+            for number in range(start, min(start + 5000, count)):
+                description = sentence(rng, rng.randint(20, 120))
+                if number % 1000 == 0:
+                    description += " bamboo"
+                if number % 10 == 0:
+                    description += " insulation"
+                batch.append(Design(
+                    title=sentence(rng, rng.randint(2, 6)),
+                    description=description,
+                    material=rng.choice(materials),
+                    contributor=rng.choice(contributors),
+                    status="approved",
+                ))
+            Design.objects.bulk_create(batch)
+        Design.objects.update_search_vectors()
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM ANALYZE nahbah_design")
+        self.stdout.write(f"Created {count} designs in {time.perf_counter() - started:.1f}s")
+
+    def run_query(self, terms, options):
+        page_size = options["page_size"]
+        design_admin = site._registry[Design]
+        searches = {
+            # What DesignAdmin.search_fields did: icontains over title, description and contributor
+            "icontains": lambda: Design.objects.filter(
+                Q(title__icontains=terms) | Q(description__icontains=terms)
+                | Q(contributor__name__icontains=terms) | Q(contributor__email__icontains=terms)
+            ).order_by("-id"),
+            "full_text": lambda: Design.objects.search(terms),
+            "admin": lambda: design_admin.get_search_results(None, Design.objects.order_by("-id"), terms)[0],
+        }
+        run = {"terms": terms}
+        for name, search in searches.items():
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                results = list(search()[:page_size])
+                matches = search().count()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            run[name] = {
+                "median_ms": round(statistics.median(timings), 2),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+                "matches": matches,
+                "returned": len(results),
+            }
+            self.stdout.write(
+                f"{terms:>14}  {name:>9}  median {run[name]['median_ms']:8.2f} ms  "
+                f"p95 {run[name]['p95_ms']:8.2f} ms  {matches:6d} matches"
+            )
+        return run
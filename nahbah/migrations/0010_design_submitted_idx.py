@@ -0,0 +1,17 @@
+# Generated by Django 5.1.9 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nahbah', '0009_bookletjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['submission_date', 'id'], name='design_submitted_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.9 on 2026-10-17 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nahbah', '0010_design_submitted_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['status', 'submission_date', 'id'], name='design_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['status', 'material', 'submission_date', 'id'], name='design_status_material_idx'),
+        ),
+    ]
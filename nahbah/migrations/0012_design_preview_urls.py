@@ -0,0 +1,23 @@
+# Generated by Django 5.1.9 on 2026-10-17 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nahbah', '0011_design_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='design',
+            name='preview_url',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='preview_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
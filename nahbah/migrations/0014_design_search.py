@@ -0,0 +1,43 @@
+# Generated by Django 5.1.9 on 2026-10-17 03:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def build_search_vectors(apps, schema_editor):
+    """Same as DesignQuerySet.update_search_vectors(), which historical models don't have."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Design = apps.get_model('nahbah', 'Design')
+    Material = apps.get_model('nahbah', 'Material')
+    config = settings.DESIGN_SEARCH_CONFIG
+    material_name = Subquery(Material.objects.filter(pk=OuterRef('material_id')).values('name')[:1])
+    Design.objects.update(search_vector=(
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config)
+        + SearchVector(material_name, weight='C', config=config)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nahbah', '0013_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='design',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='design',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='design_search_idx'),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+    ]
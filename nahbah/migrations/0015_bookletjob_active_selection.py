@@ -0,0 +1,39 @@
+# Generated by Django 5.1.9 on 2026-10-17 03:27
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """Keep the newest queued or running job of each selection, so the constraint can be added."""
+    BookletJob = apps.get_model('nahbah', 'BookletJob')
+    active = BookletJob.objects.filter(status__in=['queued', 'running']).order_by('-created_at', '-id')
+    seen = set()
+    duplicates = []
+    for job_id, selection_key in active.values_list('id', 'selection_key'):
+        if selection_key in seen:
+            duplicates.append(job_id)
+        seen.add(selection_key)
+    BookletJob.objects.filter(id__in=duplicates).update(
+        status='failed', error='A newer job renders the same booklet.', finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nahbah', '0014_design_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookletjob',
+            name='worker',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookletjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('selection_key',), name='bookletjob_active_selection_uniq'),
+        ),
+    ]
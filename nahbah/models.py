@@ -1,12 +1,46 @@
 import os
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.db import connections, models
+from django.db.models import F, OuterRef, Q, Subquery
+from django.dispatch import Signal
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 
+class CatalogVersion(models.Model):
+    """
+    A single row counting changes to designs and materials, bumped from signals
+    (see signals.py). It drives the ETag and Last-Modified headers of the
+    catalog endpoints, so unchanged responses are answered with 304.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.get_or_create(pk=1)[0]
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+
 class Material(models.Model):
     name = models.CharField(max_length=255, unique=True)
     material_image = CloudinaryField('image', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The material name is part of its designs' search vectors
+        self.design_set.update_search_vectors()
 
     def __str__(self):
         return self.name
@@ -33,6 +67,80 @@ def validate_file_type(file):
         raise ValidationError("Unsupported file type. Only PDF or image files are allowed.")
 
 
+# Sent after bulk changes to designs that bypass save() and post_save (QuerySet.update(),
+# batch submissions), with the ids of the designs and the names of the changed fields
+designs_updated = Signal()
+
+
+# Fields the stored preview URLs are built from, and the stored fields
+PREVIEW_SOURCE_FIELDS = {'design_file', 'preview_image'}
+PREVIEW_FIELDS = {'preview_url', 'preview_variants'}
+# Fields the search vector is built from, with the material name
+SEARCH_SOURCE_FIELDS = {'title', 'description', 'material', 'material_id'}
+
+
+class DesignQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        fields = set(kwargs)
+        # auto_now only applies in save()
+        kwargs.setdefault('updated_at', timezone.now())
+        design_ids = list(self.values_list('id', flat=True))
+        rows = super().update(**kwargs)
+        if PREVIEW_SOURCE_FIELDS & fields:
+            designs = list(self.model.objects.filter(id__in=design_ids))
+            for design in designs:
+                design.refresh_previews()
+            self.model.objects.bulk_update(designs, list(PREVIEW_FIELDS))
+        if SEARCH_SOURCE_FIELDS & fields:
+            self.model.objects.filter(id__in=design_ids).update_search_vectors()
+        if design_ids:
+            designs_updated.send(sender=self.model, design_ids=design_ids, fields=fields)
+        return rows
+
+    def uses_full_text_search(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def update_search_vectors(self):
+        """
+        Rebuild the search vectors of these designs from their title (weight A),
+        description (B) and material name (C). PostgreSQL only; other databases
+        search with icontains. Bypasses update() and its signals: the vector is
+        not part of any response.
+        """
+        if not self.uses_full_text_search():
+            return 0
+        config = settings.DESIGN_SEARCH_CONFIG
+        material_name = Subquery(Material.objects.filter(pk=OuterRef('material_id')).values('name')[:1])
+        return super().update(search_vector=(
+            SearchVector('title', weight='A', config=config)
+            + SearchVector('description', weight='B', config=config)
+            + SearchVector(material_name, weight='C', config=config)
+        ))
+
+    def matching(self, terms):
+        """
+        Designs matching search engine style terms ("quoted phrases", or, -excluded)
+        through the GIN index on search_vector, or icontains off PostgreSQL.
+        """
+        if not self.uses_full_text_search():
+            return self.filter(
+                Q(title__icontains=terms) | Q(description__icontains=terms) | Q(material__name__icontains=terms)
+            )
+        return self.filter(search_vector=self.search_query(terms))
+
+    def search(self, terms):
+        """Designs matching terms, best ranked first (newest first off PostgreSQL)."""
+        if not self.uses_full_text_search():
+            return self.matching(terms).order_by('-submission_date', '-id')
+        return self.matching(terms).annotate(
+            rank=SearchRank(F('search_vector'), self.search_query(terms))
+        ).order_by('-rank', '-id')
+
+    @staticmethod
+    def search_query(terms):
+        return SearchQuery(terms, search_type='websearch', config=settings.DESIGN_SEARCH_CONFIG)
+
+
 class Design(models.Model):
     title = models.CharField(max_length=255)
     material = models.ForeignKey(Material, on_delete=models.CASCADE)
@@ -44,45 +152,129 @@ class Design(models.Model):
         help_text="Upload a PDF or an image (max 5MB)"
     )
     preview_image = CloudinaryField('image', blank=True, null=True)
+    # Built from preview_image or design_file on save, see refresh_previews()
+    preview_url = models.URLField(max_length=500, blank=True, default="")
+    preview_variants = models.JSONField(default=dict, blank=True)
     contributor = models.ForeignKey(Contributor, on_delete=models.SET_NULL, blank=True, null=True)
     submission_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(
         max_length=10,
         choices=[("pending", "Pending"), ("approved", "Approved"), ("rejected", "Rejected")],
         default="pending"
     )
     rejection_reason = models.TextField(blank=True, null=True)
+    # Maintained on PostgreSQL, see DesignQuerySet.update_search_vectors()
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
 
-    def get_preview_url(self):
+    objects = DesignQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the design list (DesignCursorPagination)
+            models.Index(fields=["submission_date", "id"], name="design_submitted_idx"),
+            # Design list filtered by status (and material), in pagination order
+            models.Index(fields=["status", "submission_date", "id"], name="design_status_idx"),
+            models.Index(fields=["status", "material", "submission_date", "id"], name="design_status_material_idx"),
+            # Full text search (DesignQuerySet.search)
+            GinIndex(fields=["search_vector"], name="design_search_idx"),
+        ]
+
+    def build_preview_urls(self):
         """
-        Generate preview URL from design_file using Cloudinary transformations.
-        
-        For PDFs: Uses pg_1 transformation and converts to WebP format
-        For images: Returns the image URL with f_auto (auto WebP conversion)
-        
+        Build the preview URL and its sized variants with Cloudinary transformations,
+        from the uploaded preview_image if there is one, otherwise from design_file.
+        Returns ("", {}) when there is nothing to preview.
+
         From Cloudinary docs:
-        - pg_1 extracts first page of PDF
-        - f_auto automatically selects best format (WebP for modern browsers)
+        - Requesting a PDF in an image format renders its first page
+        - c_limit scales images down to the given width, never up
         """
-        if not self.design_file:
-            return None
-        
+        # The fields may hold a public id string until the design is loaded from the database
+        preview_image = self._meta.get_field("preview_image").to_python(self.preview_image)
+        design_file = self._meta.get_field("design_file").to_python(self.design_file)
         try:
-            file_url = str(self.design_file.url)
-            ext = os.path.splitext(file_url)[1].lower()
-            print("Design file URL:", file_url)
-            preview_image = file_url.replace(ext, '.webp')
-            print("Generated preview URL:", preview_image)
-            return preview_image
+            if preview_image:
+                preview_url = str(preview_image.url)
+                source = preview_image
+            elif design_file:
+                preview_url = design_file.build_url(format="webp")
+                source = design_file
+            else:
+                return "", {}
+            variants = {
+                name: source.build_url(
+                    format="webp", transformation=[{"width": width, "crop": "limit", "quality": "auto"}]
+                )
+                for name, width in settings.DESIGN_PREVIEW_WIDTHS.items()
+            }
         except (AttributeError, ValueError):
-            return None
-    
+            return "", {}
+        return preview_url, variants
+
+    def refresh_previews(self):
+        self.preview_url, self.preview_variants = self.build_preview_urls()
+
+    def get_preview_url(self):
+        """Stored preview URL, see refresh_previews()."""
+        return self.preview_url or None
+
+    def prepare_files(self):
+        """
+        Upload new files now (CloudinaryField would during the save) and build the
+        previews from them. Also needed before bulk_create(), which skips save().
+        """
+        for name in PREVIEW_SOURCE_FIELDS:
+            self._meta.get_field(name).pre_save(self, self._state.adding)
+        self.refresh_previews()
+
     def save(self, *args, **kwargs):
         """
-        Save the design.
-        Preview generation happens on-demand via get_preview_url() in serializer.
+        Save the design, rebuilding the stored preview URLs when the files may have changed.
         """
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or PREVIEW_SOURCE_FIELDS & set(update_fields):
+            self.prepare_files()
+            if update_fields is not None:
+                update_fields = set(update_fields) | PREVIEW_FIELDS
+        if update_fields:
+            # auto_now fields are only written when listed
+            kwargs["update_fields"] = set(update_fields) | {"updated_at"}
         super().save(*args, **kwargs)
+        if update_fields is None or SEARCH_SOURCE_FIELDS & set(update_fields):
+            Design.objects.filter(pk=self.pk).update_search_vectors()
 
     def __str__(self):
         return self.title
+
+
+class BookletJob(models.Model):
+    """A booklet rendered in the background; polled by the client until it is done."""
+    selection_key = models.CharField(max_length=64, db_index=True)
+    design_ids = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=10,
+        choices=[("queued", "Queued"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")],
+        default="queued"
+    )
+    file_path = models.CharField(max_length=500, blank=True)
+    timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, null=True)
+    # The process that queued and runs the job (booklet_jobs.get_worker)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            # Identical selections share one job while it is queued or running (booklet_jobs.submit_booklet_job)
+            models.UniqueConstraint(
+                fields=["selection_key"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="bookletjob_active_selection_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Booklet job {self.pk} ({self.status})"
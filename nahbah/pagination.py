@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class DesignCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (submission_date, id), served by the
+    design_submitted_idx index, so every page costs the same however deep it is.
+    Clients follow the next/previous links; page_size can be lowered or raised
+    up to DESIGN_LIST_MAX_PAGE_SIZE.
+
+    DRF's cursor only holds the first ordering field and skips the designs
+    sharing it with an offset, which loses designs when designs submitted at
+    the same instant straddle a page boundary on the way back. Here the cursor
+    holds the whole (submission_date, id) position, which is unique, so the
+    offset stays 0.
+    """
+    ordering = ("submission_date", "id")
+    page_size = settings.DESIGN_LIST_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.DESIGN_LIST_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """CursorPagination.paginate_queryset(), filtering on the whole position."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        if reverse:
+            queryset = queryset.order_by(*(f"-{field}" for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.position_filter(current_position, reverse))
+
+        # One design more than the page tells whether another page follows
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        return f"{instance.submission_date.isoformat()}|{instance.id}"
+
+    def position_filter(self, position, reverse):
+        """
+        The designs after position, or before it when paging back. Positions of
+        cursors from before the id was part of them only hold the date.
+        """
+        date, _, design_id = position.partition("|")
+        submission_date = parse_datetime(date)
+        if submission_date is None or not (design_id.isdigit() or design_id == ""):
+            raise NotFound(self.invalid_cursor_message)
+        lookup = "lt" if reverse else "gt"
+        if not design_id:
+            return Q(**{f"submission_date__{lookup}": submission_date})
+        # The bound on submission_date alone is the range scanned in the index
+        return Q(**{f"submission_date__{lookup}e": submission_date}) & (
+            Q(**{f"submission_date__{lookup}": submission_date}) | Q(**{f"id__{lookup}": int(design_id)})
+        )
+
+
+class DesignSearchPagination(PageNumberPagination):
+    """
+    Search results are ordered by rank, which a cursor can't follow, so they
+    are paged by number; people rarely go past the first few pages.
+    """
+    page_size = settings.DESIGN_LIST_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.DESIGN_LIST_MAX_PAGE_SIZE
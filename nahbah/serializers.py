@@ -1,6 +1,7 @@
 import json
 from rest_framework import serializers
-from .models import Contributor, Design, Material
+from django.urls import reverse
+from .models import BookletJob, Contributor, Design, Material
 from cloudinary.utils import cloudinary_url
 
 
@@ -30,10 +31,37 @@ class CustomPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
     def to_internal_value(self, data):
         if data == -1 or str(data) == '-1':
             return -1  # Skip validation for -1
-        return super().to_internal_value(data)
+        materials = self.context.get('materials')
+        if materials is None:
+            return super().to_internal_value(data)
+        # Batch submissions look up all their materials in one query beforehand
+        try:
+            return materials[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+def parse_contributor(contributor_data):
+    """Contributor details given as a dict or a JSON string."""
+    if isinstance(contributor_data, str):
+        contributor_data = json.loads(contributor_data)
+    return contributor_data
+
+
+def parse_list_param(value):
+    """Split a comma-separated query parameter into its non-empty values."""
+    return [item.strip() for item in value.split(",") if item.strip()]
 
 
 class DesignSerializer(serializers.ModelSerializer):
+    """
+    On GET requests the representation can be trimmed with ?fields=id,title or
+    ?omit=description,rejection_reason. With ?include=materials each design in
+    a list carries its material_id instead of the nested material, and the list
+    sends the materials once (see DesignViewSet.get_paginated_response).
+    """
     contributor = serializers.JSONField(write_only=True)  # Accept JSON string
     material = MaterialSerializer(read_only=True)
     material_id = CustomPrimaryKeyRelatedField(  # Use custom field
@@ -45,29 +73,46 @@ class DesignSerializer(serializers.ModelSerializer):
     custom_material_name = serializers.CharField(write_only=True, required=False)
     design_file = serializers.FileField(required=False, allow_null=True)
     preview_image = serializers.SerializerMethodField()
+    preview_variants = serializers.JSONField(read_only=True)
 
     class Meta:
         model = Design
-        fields = ['id', 'title', 'description', 'design_file', 'preview_image', 'material', 'material_id', 'custom_material_name',
-                  'contributor', 'submission_date', 'status', 'rejection_reason']
+        fields = ['id', 'title', 'description', 'design_file', 'preview_image', 'preview_variants', 'material',
+                  'material_id', 'custom_material_name', 'contributor', 'submission_date', 'status', 'rejection_reason']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and request.method == "GET":
+            self.select_fields(request.query_params)
+
+    def select_fields(self, query_params):
+        includes = parse_list_param(query_params.get("include", ""))
+        if not set(includes) <= {"materials"}:
+            raise serializers.ValidationError({"error": "Only include=materials is supported."})
+        # Materials are only sideloaded by lists, a single design keeps its nested material
+        view = self.context.get("view")
+        if includes and not getattr(view, "detail", True):
+            self.fields.pop("material")
+            self.fields["material_id"] = serializers.IntegerField(read_only=True)
+
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        requested = parse_list_param(query_params.get("fields", "")) or readable
+        omitted = parse_list_param(query_params.get("omit", ""))
+        unknown = set(requested + omitted) - set(readable)
+        if unknown:
+            raise serializers.ValidationError({"error": f"Unknown fields: {', '.join(sorted(unknown))}"})
+        for name in readable:
+            if name not in requested or name in omitted:
+                self.fields.pop(name)
 
     def get_preview_image(self, obj):
         """
-        Return preview image URL.
-        Priority:
-        1. If preview_image field has a manually uploaded file, return it
-        2. Otherwise, generate from design_file using Cloudinary transformations
+        Return the preview image URL stored on the design: the manually uploaded
+        preview_image if there is one, otherwise derived from design_file.
         """
-        # If admin uploaded a custom preview, use that
-        if obj.preview_image:
-            return str(obj.preview_image.url)
-        
-        # Otherwise, generate from design_file
-        if obj.design_file:
-            return obj.get_preview_url()
-        
-        return None
-    
+        return obj.preview_url or None
+
     def validate(self, data):
         """
         Handle -1 as a custom material indicator.
@@ -97,12 +142,8 @@ class DesignSerializer(serializers.ModelSerializer):
             validated_data['material'] = material
 
         # Parse contributor JSON string
-        contributor_data = validated_data.pop("contributor", None)
+        contributor_data = parse_contributor(validated_data.pop("contributor", None))
         if contributor_data:
-            # If it's a string, parse it
-            if isinstance(contributor_data, str):
-                contributor_data = json.loads(contributor_data)
-            
             email = contributor_data.get("email")
             contributor, created = Contributor.objects.get_or_create(
                 email=email, 
@@ -110,4 +151,22 @@ class DesignSerializer(serializers.ModelSerializer):
             )
             validated_data["contributor"] = contributor
 
-        return Design.objects.create(**validated_data)
\ No newline at end of file
+        return Design.objects.create(**validated_data)
+
+
+class BookletJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BookletJob
+        fields = ['id', 'status', 'design_ids', 'timings', 'error', 'created_at', 'started_at', 'finished_at',
+                  'download_url']
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        """URL of the finished booklet, only once the job is done."""
+        if obj.status != "done":
+            return None
+        url = reverse("bookletjob-download", args=[obj.pk])
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
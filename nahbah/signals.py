@@ -0,0 +1,146 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from import_export.signals import post_import
+
+from .models import PREVIEW_FIELDS, CatalogVersion, Contributor, Design, Material, designs_updated
+from .utils import booklet_cache, file_cache, fragment_cache, master_booklet, response_cache
+from .utils.booklet_cache import get_booklet_cache
+from .utils.booklet_jobs import schedule_design_refresh
+from .utils.fragment_cache import get_fragment_cache
+from .utils.response_cache import get_response_cache
+
+# Bulk updates of more designs than this invalidate every cached response rather than each design's
+RESPONSE_INVALIDATION_LIMIT = 100
+
+# Settings the cache and master booklet singletons are built from
+CACHE_SETTINGS = {
+    "BOOKLET_FRAGMENT_CACHE",
+    "BOOKLET_RESULT_CACHE",
+    "DESIGN_FILE_CACHE",
+    "MASTER_BOOKLET_DIR",
+    "RESPONSE_CACHE_ALIAS",
+}
+
+
+@receiver(post_save, sender=Design)
+@receiver(post_delete, sender=Design)
+def invalidate_design_caches(sender, instance, **kwargs):
+    """
+    Drop the cached fragment of a design and every cached booklet containing it
+    whenever it is saved (API, moderate/edit actions, admin) or deleted.
+    """
+    get_fragment_cache().delete_design(instance.pk)
+    get_booklet_cache().invalidate_design(instance.pk)
+
+
+@receiver(designs_updated, sender=Design)
+def invalidate_updated_designs(sender, design_ids, fields, **kwargs):
+    """Same as above for bulk updates such as the approve_designs admin action."""
+    if fields <= PREVIEW_FIELDS:
+        return  # Booklets don't use the preview URLs
+    for design_id in design_ids:
+        get_fragment_cache().delete_design(design_id)
+        get_booklet_cache().invalidate_design(design_id)
+
+
+@receiver(post_save, sender=Design)
+def refresh_saved_design(sender, instance, raw=False, **kwargs):
+    """
+    Pre-render the booklet fragment of an approved design (e.g. after DesignViewSet.moderate)
+    and splice it into, or remove it from, the master booklet.
+    """
+    if not raw:
+        schedule_design_refresh([instance.pk])
+
+
+@receiver(post_delete, sender=Design)
+def refresh_deleted_design(sender, instance, **kwargs):
+    """Remove a deleted design's pages from the master booklet."""
+    schedule_design_refresh([instance.pk])
+
+
+@receiver(designs_updated, sender=Design)
+def refresh_updated_designs(sender, design_ids, fields, **kwargs):
+    """Same for bulk updates such as the approve_designs admin action, which bypass save()."""
+    if not fields <= PREVIEW_FIELDS:
+        schedule_design_refresh(design_ids)
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Contributor)
+@receiver(pre_delete, sender=Material)
+@receiver(pre_delete, sender=Contributor)
+def refresh_related_designs(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Booklet pages show the material and contributor names: drop the cached booklets
+    with designs of a renamed or deleted material or contributor, and refresh their
+    fragments and master booklet pages. Runs before deletes, while design_set is
+    still filled in.
+    """
+    if created or raw:
+        return
+    design_ids = list(instance.design_set.values_list("id", flat=True))
+    for design_id in design_ids:
+        get_booklet_cache().invalidate_design(design_id)
+    schedule_design_refresh(design_ids)
+
+
+@receiver(post_save, sender=Design)
+@receiver(post_delete, sender=Design)
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+@receiver(post_save, sender=Contributor)
+@receiver(post_delete, sender=Contributor)
+@receiver(designs_updated, sender=Design)
+def bump_catalog_version(sender, **kwargs):
+    """
+    Invalidate the ETags of the design and material endpoints on every change:
+    API, admin (including import-export and the approve_designs action) and bulk updates.
+    Booklets built while the version changed are not cached (views.cached_booklet).
+    """
+    CatalogVersion.bump()
+
+
+@receiver(post_save, sender=Design)
+@receiver(post_delete, sender=Design)
+def invalidate_design_responses(sender, instance, **kwargs):
+    """Drop the cached design list pages and the cached detail of the design."""
+    get_response_cache().invalidate("designs", f"design:{instance.pk}")
+
+
+@receiver(designs_updated, sender=Design)
+def invalidate_updated_design_responses(sender, design_ids, **kwargs):
+    if len(design_ids) > RESPONSE_INVALIDATION_LIMIT:
+        get_response_cache().invalidate("catalog")
+    else:
+        get_response_cache().invalidate("designs", *(f"design:{design_id}" for design_id in design_ids))
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def invalidate_material_responses(sender, instance, **kwargs):
+    """Design responses include their material, so they depend on "materials" too."""
+    get_response_cache().invalidate("materials")
+
+
+@receiver(post_import)
+def invalidate_imported_responses(sender, model, **kwargs):
+    """
+    Import-export saves each row, which sends the signals above, unless a
+    resource is configured for bulk imports; start over after every import.
+    """
+    if model in (Design, Material):
+        CatalogVersion.bump()
+        get_response_cache().invalidate("catalog")
+
+
+@receiver(setting_changed)
+def reset_cache_singletons(setting, **kwargs):
+    """Build the caches and the master booklet again from overridden settings (override_settings in tests)."""
+    if setting in CACHE_SETTINGS:
+        booklet_cache._booklet_cache = None
+        file_cache._design_file_cache = None
+        fragment_cache._fragment_cache = None
+        master_booklet._master_booklet = None
+        response_cache._response_cache = None
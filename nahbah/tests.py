@@ -1,3 +1,1647 @@
-from django.test import TestCase
+import base64
+import fcntl
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+import cloudinary
+import fitz  # PyMuPDF
+import requests
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from nahbah.admin import approve_designs
+from nahbah.models import BookletJob, CatalogVersion, Contributor, Design, Material, designs_updated
+from nahbah.utils.booklet_cache import get_booklet_cache
+from nahbah.utils.booklet_jobs import (
+    expire_stale_jobs,
+    fail_orphaned_jobs,
+    get_worker,
+    job_file_path,
+    run_booklet_job,
+    schedule_design_refresh,
+    schedule_master_build,
+    submit_booklet_job,
+)
+from nahbah.utils.disk_cache import RESCAN_INTERVAL, DiskLRUCache
+from nahbah.utils.file_cache import DesignFileCache
+from nahbah.utils.file_response import parse_range, ranged_file_response
+from nahbah.utils.fragment_cache import DiskFragmentCache, fragment_key, get_fragment_cache
+from nahbah.utils.generate_booklet import A6, SAVE_PROFILES, add_design_file_pages, generate_booklet, iter_design_files
+from nahbah.utils.image_ingest import ingest_image, target_size
+from nahbah.utils.master_booklet import get_master_booklet
+from nahbah.utils.qr_codes import insert_qr_code, qr_matrix
+from nahbah.utils.render_pool import discard_render_pool
+from nahbah.utils.remote_files import CircuitBreaker, CircuitOpenError, FetchedFile, download, get_circuit_breaker
+from nahbah.utils.render_limits import render_limit_stats, render_slot
+from nahbah.views import cached_booklet
+
+_no_response_cache = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "responses": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+def cache_settings(cache_dir):
+    """The settings derived from BOOKLET_CACHE_DIR, all under cache_dir."""
+    return {
+        "BOOKLET_CACHE_DIR": cache_dir,
+        "BOOKLET_FRAGMENT_CACHE": {"BACKEND": "nahbah.utils.fragment_cache.DummyFragmentCache"},
+        "BOOKLET_RESULT_CACHE": {"LOCATION": f"{cache_dir}/booklets", "MAX_SIZE": 64 * 1024 * 1024},
+        "DESIGN_FILE_CACHE": {"LOCATION": f"{cache_dir}/files", "MAX_SIZE": 64 * 1024 * 1024},
+        "BOOKLET_LOCK_DIR": f"{cache_dir}/locks",
+        "MASTER_BOOKLET_DIR": f"{cache_dir}/master",
+        "BOOKLET_JOB_DIR": f"{cache_dir}/jobs",
+    }
+
+
+@override_settings(CACHES=_no_response_cache)
+class CacheTestCase(TestCase):
+    """
+    Keeps booklets, fragments, design files, locks, jobs and the master booklet in
+    a temporary directory of each test, and disables the response cache unless a
+    subclass overrides CACHES. The signals rebuild the cache singletons when these
+    settings change.
+    """
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp(prefix="nahbah-tests-")
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.enterContext(override_settings(**cache_settings(cache_dir)))
+
+
+class QueryCountTests(CacheTestCase):
+    """
+    Upper bounds on the database queries of each API endpoint. Every endpoint
+    is requested with few and with many rows, and must stay within the same
+    budget, so a serializer change that queries per row fails here.
+    Catalog endpoints read the CatalogVersion first, for their ETag.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def add_designs(self, count):
+        batch = Design.objects.count()
+        designs = Design.objects.bulk_create([
+            Design(
+                title=f"Design {number}",
+                description="A description",
+                material=Material.objects.create(name=f"Material {batch}-{number}"),
+                contributor=Contributor.objects.create(
+                    name=f"Contributor {batch}-{number}", email=f"contributor{batch}-{number}@example.com"
+                ),
+                status="approved",
+            )
+            for number in range(count)
+        ])
+        return [design.id for design in designs]
+
+    def assertMaxQueries(self, budget, path, data=None, rows=(1, 20)):
+        """
+        Request path after creating each number of designs in turn (each with its
+        own material and contributor), asserting at most budget queries. path and data may be
+        callables taking the ids of the designs just created.
+        """
+        for count in rows:
+            design_ids = self.add_designs(count)
+            request_path = path(design_ids) if callable(path) else path
+            request_data = data(design_ids) if callable(data) else data
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(request_path, request_data)
+            self.assertLess(response.status_code, 400, f"{request_path} returned {response.status_code}")
+            self.assertLessEqual(
+                len(queries),
+                budget,
+                f"{request_path} ran {len(queries)} queries with {count} new designs:\n"
+                + "\n".join(query["sql"] for query in queries.captured_queries),
+            )
+
+    def test_design_list(self):
+        self.assertMaxQueries(2, "/api/designs/", {"page_size": 100})
+
+    def test_design_list_filtered(self):
+        def data(design_ids):
+            return {"status": "approved", "contributor": Design.objects.get(id=design_ids[-1]).contributor_id}
+
+        self.assertMaxQueries(2, "/api/designs/", data)
+
+    def test_design_list_sideloaded(self):
+        self.assertMaxQueries(2, "/api/designs/", {"page_size": 100, "include": "materials", "omit": "description"})
+
+    def test_design_search(self):
+        self.assertMaxQueries(2, "/api/designs/search/", {"q": "design", "page_size": 100, "include": "materials"})
+
+    def test_design_detail(self):
+        self.assertMaxQueries(2, lambda design_ids: f"/api/designs/{design_ids[0]}/")
+
+    def test_material_list(self):
+        self.assertMaxQueries(2, "/api/materials/")
+
+    def test_contributor_list(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_authenticate(user)
+        self.assertMaxQueries(1, "/api/contributors/")
+
+    def test_download_booklet(self):
+        # The approved designs, the designs to render and the catalog version before and after rendering
+        self.assertMaxQueries(
+            4, "/api/designs/download_booklet/", lambda design_ids: {"design_ids": ",".join(map(str, design_ids))}
+        )
+
+
+class PaginationTests(CacheTestCase):
+    """Walking the design list by its cursors, with designs submitted at the same instant across page boundaries."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        material = Material.objects.create(name="Wood")
+        designs = [
+            Design.objects.create(title=f"Design {number}", description="", material=material, status="approved")
+            for number in range(11)
+        ]
+        # Runs of 1, 3, 5 and 2 designs share a submission date, not in id order
+        days = [2, 1, 2, 3, 2, 3, 3, 4, 3, 4, 3]
+        for design, day in zip(designs, days):
+            Design.objects.filter(id=design.id).update(submission_date=timezone.make_aware(datetime(2024, 1, day)))
+        self.expected = [design.id for _, design in sorted(zip(days, designs), key=lambda pair: (pair[0], pair[1].id))]
+
+    def walk(self, url, link):
+        """The ids of each page, following the link ("next" or "previous") from url to the end."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([design["id"] for design in response.json()["results"]])
+            url = response.json()[link]
+        return pages
+
+    def test_forward_and_back(self):
+        for page_size in (1, 2, 3, 4):
+            with self.subTest(page_size=page_size):
+                pages = self.walk(f"/api/designs/?page_size={page_size}", "next")
+                self.assertEqual(sum(pages, []), self.expected)
+                self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+
+                # Back from the last page, through the previous links
+                last = self.client.get(f"/api/designs/?page_size={page_size}")
+                while last.json()["next"]:
+                    last = self.client.get(last.json()["next"])
+                previous_pages = self.walk(last.json()["previous"], "previous") if last.json()["previous"] else []
+                self.assertEqual(sum(reversed(previous_pages), []) + pages[-1], self.expected)
+
+    def test_invalid_cursor(self):
+        for position in ("yesterday|1", "2024-01-01T00:00:00+00:00|x"):
+            cursor = base64.b64encode(urlencode({"p": position}).encode()).decode()
+            self.assertEqual(self.client.get("/api/designs/", {"cursor": cursor}).status_code, 404)
+
+
+class SparseFieldsetTests(CacheTestCase):
+    """?fields=, ?omit= and ?include=materials on the design endpoints."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        wood, clay = Material.objects.create(name="Wood"), Material.objects.create(name="Clay")
+        Design.objects.bulk_create([
+            Design(title=f"Design {number}", description="", material=material, status="approved")
+            for number, material in enumerate([wood, clay, wood])
+        ])
+        self.materials = {str(wood.id): "Wood", str(clay.id): "Clay"}
+
+    def test_fields_and_omit(self):
+        response = self.client.get("/api/designs/", {"fields": "id,title,description", "omit": "description"})
+        self.assertEqual(list(response.json()["results"][0]), ["id", "title"])
+
+    def test_unknown_field(self):
+        response = self.client.get("/api/designs/", {"fields": "id,contributor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_include_materials(self):
+        body = self.client.get("/api/designs/", {"include": "materials"}).json()
+        self.assertEqual({id: material["name"] for id, material in body["materials"].items()}, self.materials)
+        self.assertNotIn("material", body["results"][0])
+        self.assertIn(str(body["results"][0]["material_id"]), body["materials"])
+
+    def test_detail_keeps_nested_material(self):
+        design = Design.objects.first()
+        body = self.client.get(f"/api/designs/{design.id}/", {"include": "materials"}).json()
+        self.assertEqual(body["material"]["name"], design.material.name)
+
+
+class SearchTests(CacheTestCase):
+    """The search endpoint, on PostgreSQL through the maintained search vectors."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.material = Material.objects.create(name="Bamboo")
+        self.in_title = Design.objects.create(
+            title="Straw wall", description="Warm and cheap", material=self.material, status="approved"
+        )
+        self.in_description = Design.objects.create(
+            title="Shelter", description="A frame filled with straw", material=self.material, status="approved"
+        )
+        Design.objects.create(title="Straw roof", description="", material=self.material, status="pending")
+
+    def search(self, terms):
+        response = self.client.get("/api/designs/search/", {"q": terms})
+        self.assertEqual(response.status_code, 200)
+        return [design["id"] for design in response.json()["results"]]
+
+    def test_matches_approved_designs(self):
+        self.assertCountEqual(self.search("straw"), [self.in_title.id, self.in_description.id])
+
+    @skipUnless(connection.vendor == "postgresql", "Ranking needs full text search")
+    def test_title_ranks_above_description(self):
+        self.assertEqual(self.search("straw"), [self.in_title.id, self.in_description.id])
+
+    def test_vectors_follow_updates(self):
+        Design.objects.filter(id=self.in_description.id).update(title="Clay dome")
+        self.material.name = "Cane"
+        self.material.save()
+        self.assertEqual(self.search("dome"), [self.in_description.id])
+        self.assertCountEqual(self.search("cane"), [self.in_title.id, self.in_description.id])
+
+    def test_no_terms(self):
+        self.assertEqual(self.client.get("/api/designs/search/").status_code, 400)
+
+
+class DesignFilterTests(CacheTestCase):
+    """The filters of the design list, and what anonymous visitors see by default."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        wood, straw = Material.objects.create(name="Wood"), Material.objects.create(name="Straw")
+        ada = Contributor.objects.create(name="Ada", email="ada@example.com")
+        bo = Contributor.objects.create(name="Bo", email="bo@example.com")
+        self.materials, self.contributors = {"wood": wood, "straw": straw}, {"ada": ada, "bo": bo}
+        self.designs = {
+            title: Design.objects.create(
+                title=title, description="", material=material, contributor=contributor, status=status
+            )
+            for title, material, contributor, status in [
+                ("Frame", wood, ada, "approved"),
+                ("Bale wall", straw, bo, "approved"),
+                ("Roof", wood, bo, "pending"),
+                ("Floor", straw, None, "rejected"),
+            ]
+        }
+        Design.objects.filter(title="Frame").update(submission_date=timezone.make_aware(datetime(2024, 1, 1)))
+
+    def titles(self, data=None):
+        response = self.client.get("/api/designs/", data)
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(design["title"] for design in response.json()["results"])
+
+    def test_anonymous_visitors_see_approved_designs(self):
+        self.assertEqual(self.titles(), ["Bale wall", "Frame"])
+        self.assertEqual(self.titles({"status": "pending"}), ["Roof"])
+
+    def test_staff_see_every_design(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_authenticate(user)
+        self.assertEqual(self.titles(), ["Bale wall", "Floor", "Frame", "Roof"])
+        self.assertEqual(self.titles({"status": "pending,rejected"}), ["Floor", "Roof"])
+
+    def test_material_and_contributor(self):
+        wood, straw = self.materials["wood"].id, self.materials["straw"].id
+        self.assertEqual(self.titles({"material": wood}), ["Frame"])
+        self.assertEqual(self.titles({"material": f"{wood}, {straw}"}), ["Bale wall", "Frame"])
+        self.assertEqual(self.titles({"contributor": self.contributors["bo"].id}), ["Bale wall"])
+        self.assertEqual(self.titles({"material": wood, "contributor": self.contributors["bo"].id}), [])
+
+    def test_submission_date(self):
+        self.assertEqual(self.titles({"submitted_before": "2024-01-02"}), ["Frame"])
+        self.assertEqual(self.titles({"submitted_after": "2024-01-02T00:00:00Z"}), ["Bale wall"])
+
+    def test_invalid_values(self):
+        for data in [
+            {"material": "abc"},
+            {"material": f"{self.materials['wood'].id},abc"},
+            {"material": ""},
+            {"contributor": "x"},
+            {"contributor": "-1"},
+            {"status": "lost"},
+            {"submitted_after": "yesterday"},
+        ]:
+            with self.subTest(data):
+                response = self.client.get("/api/designs/", data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class ConditionalGetTests(CacheTestCase):
+    """Catalog responses are revalidated with ETag / Last-Modified and change on every write path."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.material = Material.objects.create(name="Wood")
+        self.design = Design.objects.create(
+            title="Design", description="A description", material=self.material, status="pending"
+        )
+
+    def assertRevalidated(self, path, write=None):
+        """Request path, then revalidate it: 304 before write() and 200 with a new ETag after it."""
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1, "A 304 should only read the catalog version")
+        self.assertEqual(response["ETag"], etag)
+
+        if write:
+            write()
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_design_list(self):
+        self.assertRevalidated(
+            "/api/designs/?status=pending,approved", lambda: Design.objects.update(status="approved")
+        )
+
+    def test_design_detail(self):
+        def save():
+            self.design.title = "Renamed"
+            self.design.save(update_fields=["title"])
+
+        self.assertRevalidated(f"/api/designs/{self.design.id}/", save)
+
+    def test_material_list(self):
+        self.assertRevalidated("/api/materials/", lambda: Material.objects.create(name="Clay"))
+
+    def test_delete(self):
+        self.assertRevalidated("/api/designs/?status=pending", self.design.delete)
+
+    def test_preview_update(self):
+        self.assertRevalidated(
+            "/api/designs/?status=pending", lambda: Design.objects.update(preview_url="https://example.com/a.webp")
+        )
+
+    def test_if_modified_since(self):
+        response = self.client.get("/api/materials/")
+        response = self.client.get("/api/materials/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_query(self):
+        etag = self.client.get("/api/designs/?status=pending")["ETag"]
+        response = self.client.get("/api/designs/?status=approved", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_update_sets_updated_at(self):
+        updated_at = Design.objects.get().updated_at
+        Design.objects.update(status="approved")
+        self.assertGreater(Design.objects.get().updated_at, updated_at)
+        self.assertGreater(CatalogVersion.current().version, 0)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "responses": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-responses"},
+    },
+)
+class ResponseCacheTests(CacheTestCase):
+    """Cached catalog responses are served without queries and invalidated by the writes they depend on."""
+
+    def setUp(self):
+        super().setUp()
+        caches["responses"].clear()
+        # Committed writes would refresh booklets in background threads, which the test database can't serve
+        patcher = mock.patch("nahbah.signals.schedule_design_refresh")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.material = Material.objects.create(name="Wood")
+        self.designs = [
+            Design.objects.create(title=f"Design {number}", description="", material=self.material, status="approved")
+            for number in range(2)
+        ]
+
+    def get(self, path):
+        """Request path, returning the response and the number of queries beyond the catalog version."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries) - 1
+
+    def assertCached(self, path):
+        response, _ = self.get(path)
+        cached_response, queries = self.get(path)
+        self.assertEqual(queries, 0, f"{path} was not served from the response cache")
+        self.assertEqual(cached_response.json(), response.json())
+
+    def assertNotCached(self, path):
+        _, queries = self.get(path)
+        self.assertGreater(queries, 0, f"{path} was served from the response cache")
+
+    def test_material_list(self):
+        self.assertCached("/api/materials/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Material.objects.create(name="Clay")
+        self.assertEqual(len(self.get("/api/materials/")[0].json()), 2)
+
+    def test_design_list(self):
+        self.assertCached("/api/designs/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Design.objects.filter(id=self.designs[0].id).update(status="rejected")
+        self.assertEqual(len(self.get("/api/designs/")[0].json()["results"]), 1)
+
+    def test_material_change_invalidates_designs(self):
+        self.assertCached("/api/designs/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material.name = "Oak"
+            self.material.save()
+        self.assertEqual(self.get("/api/designs/")[0].json()["results"][0]["material"]["name"], "Oak")
+
+    def test_design_detail_is_invalidated_precisely(self):
+        first, second = (f"/api/designs/{design.id}/" for design in self.designs)
+        self.assertCached(first)
+        self.assertCached(second)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.designs[0].title = "Renamed"
+            self.designs[0].save()
+        self.assertEqual(self.get(first)[0].json()["title"], "Renamed")
+        self.assertCached(second)
+
+    def test_moderation_list_is_not_cached(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_authenticate(user)
+        self.get("/api/designs/")
+        self.assertNotCached("/api/designs/")
+
+    def test_import_invalidates(self):
+        from import_export.signals import post_import
+
+        self.assertCached("/api/materials/")
+        with self.captureOnCommitCallbacks(execute=True):
+            post_import.send(sender=None, model=Material)
+        self.assertNotCached("/api/materials/")
+
+
+class PreviewTests(CacheTestCase):
+    """Stored preview URLs: Design.build_preview_urls(), save() and the backfill_previews command."""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(cloudinary.config(), "cloud_name", "demo", create=True))
+        self.material = Material.objects.create(name="Wood")
+        self.contributor = Contributor.objects.create(name="Ada", email="ada@example.com")
+
+    def design(self, **fields):
+        return Design.objects.create(
+            title="Frame", description="A frame", material=self.material, contributor=self.contributor, **fields
+        )
+
+    def assertPreviewOf(self, design, public_id):
+        self.assertIn(f"/{public_id}.", design.preview_url)
+        self.assertEqual(set(design.preview_variants), set(settings.DESIGN_PREVIEW_WIDTHS))
+        for name, width in settings.DESIGN_PREVIEW_WIDTHS.items():
+            self.assertIn(f"w_{width}", design.preview_variants[name])
+            self.assertTrue(design.preview_variants[name].endswith(f"/{public_id}.webp"))
+
+    def test_build_preview_urls(self):
+        preview_url, variants = Design(design_file="designs/frame.pdf").build_preview_urls()
+        self.assertTrue(preview_url.endswith("/designs/frame.webp"))
+        self.assertIn("c_limit", variants["thumbnail"])
+        # The uploaded preview image takes precedence over the design file
+        preview_url, variants = Design(
+            design_file="designs/frame.pdf", preview_image="previews/frame.png"
+        ).build_preview_urls()
+        self.assertTrue(preview_url.endswith("/previews/frame.png"))
+        self.assertTrue(variants["large"].endswith("/previews/frame.webp"))
+        self.assertEqual(Design().build_preview_urls(), ("", {}))
+
+    def test_save_update_fields(self):
+        design = self.design(design_file="designs/frame.pdf")
+        self.assertPreviewOf(Design.objects.get(pk=design.pk), "designs/frame")
+
+        design.design_file = "designs/panel.pdf"
+        design.save(update_fields=["design_file"])
+        self.assertPreviewOf(Design.objects.get(pk=design.pk), "designs/panel")
+
+        # Other fields leave the stored previews alone
+        design.design_file = "designs/other.pdf"
+        design.title = "Panel"
+        design.save(update_fields=["title"])
+        stored = Design.objects.get(pk=design.pk)
+        self.assertEqual(stored.title, "Panel")
+        self.assertPreviewOf(stored, "designs/panel")
+
+    def test_backfill_previews(self):
+        designs = [self.design(design_file=f"designs/frame{number}.pdf") for number in range(3)]
+        done = self.design(design_file="designs/done.pdf")
+        Design.objects.filter(pk__in=[design.pk for design in designs]).update(preview_url="", preview_variants={})
+        Design.objects.filter(pk=done.pk).update(preview_url="https://example.com/done.webp")
+        sent = []
+
+        def receiver(design_ids, fields, **kwargs):
+            sent.append((sorted(design_ids), set(fields)))
+
+        designs_updated.connect(receiver, sender=Design)
+        self.addCleanup(designs_updated.disconnect, receiver, sender=Design)
+        stdout = StringIO()
+        call_command("backfill_previews", batch_size=2, stdout=stdout)
+
+        self.assertIn("Stored previews of 3 designs.", stdout.getvalue())
+        for number, design in enumerate(designs):
+            self.assertPreviewOf(Design.objects.get(pk=design.pk), f"designs/frame{number}")
+        self.assertEqual(Design.objects.get(pk=done.pk).preview_url, "https://example.com/done.webp")
+        # designs_updated is sent once per batch, by the bulk update
+        self.assertEqual([design_ids for design_ids, fields in sent], [
+            sorted(design.pk for design in designs[:2]), [designs[2].pk]
+        ])
+        self.assertTrue(all(fields >= {"preview_url", "preview_variants"} for design_ids, fields in sent))
+
+        call_command("backfill_previews", "--all", stdout=stdout)
+        self.assertPreviewOf(Design.objects.get(pk=done.pk), "designs/done")
+
+
+@override_settings(DESIGN_BATCH_MAX_SIZE=50)
+class BatchSubmissionTests(CacheTestCase):
+    """Batch submissions create designs with a fixed number of queries and do what save() would."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.material = Material.objects.create(name="Wood")
+        Contributor.objects.create(name="Ada", email="ada@example.com")
+
+    def items(self, count):
+        """Designs in new materials (every other one, three names) by four new contributors."""
+        items = []
+        for number in range(count):
+            item = {
+                "title": f"Design {number}",
+                "description": "Woven straw panels",
+                "material_id": self.material.id,
+                "contributor": {"name": f"Workshop {number % 4}", "email": f"workshop{number % 4}@example.com"},
+            }
+            if number % 2 == 0:
+                item.update(material_id=-1, custom_material_name=f"Material {number % 3}")
+            items.append(item)
+        return items
+
+    def submit(self, items):
+        return self.client.post("/api/designs/batch/", {"designs": items}, format="json")
+
+    def test_creates_designs(self):
+        items = self.items(4) + [{
+            "title": "Ada's design",
+            "description": "A frame",
+            "material_id": self.material.id,
+            "contributor": {"name": "Ada", "email": "ada@example.com"},
+        }]
+        response = self.submit(items)
+        self.assertEqual(response.status_code, 201)
+        designs = Design.objects.in_bulk([result["id"] for result in response.json()["results"]])
+        self.assertEqual(len(designs), 5)
+        self.assertEqual(Material.objects.filter(name__startswith="Material ").count(), 2)
+        self.assertEqual(Contributor.objects.count(), 5)
+        self.assertEqual(Contributor.objects.get(email="ada@example.com").design_set.count(), 1)
+        search = self.client.get("/api/designs/search/", {"q": "straw", "status": "pending"})
+        self.assertEqual(search.json()["count"], 4)
+
+    def test_contributors_without_email(self):
+        """Like single submissions, batches reuse the contributor with a blank or missing email."""
+        single = self.client.post("/api/designs/", {
+            "title": "Roof", "description": "Thatch", "material_id": self.material.id,
+            "contributor": json.dumps({"name": "Anonymous", "email": ""}),
+        })
+        self.assertEqual(single.status_code, 201, single.content)
+        for _ in range(2):
+            items = self.items(2)
+            items[0]["contributor"] = {"name": "Someone", "email": ""}
+            items[1]["contributor"] = {"name": "Someone else"}
+            self.assertEqual(self.submit(items).status_code, 201)
+        self.assertEqual(Contributor.objects.filter(email="").count(), 1)
+        self.assertEqual(Contributor.objects.get(email="").design_set.count(), 3)
+        self.assertEqual(Contributor.objects.filter(email__isnull=True).count(), 1)
+        self.assertEqual(Contributor.objects.get(email__isnull=True).design_set.count(), 2)
+
+    def test_query_count_does_not_grow(self):
+        query_counts = []
+        for count in (2, 40):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.submit(self.items(count)).status_code, 201)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_partial_failure(self):
+        version = CatalogVersion.current().version
+        response = self.submit(self.items(2) + [{"title": "", "description": "", "material_id": 0}])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "created", "error"])
+        self.assertIn("material_id", results[2]["errors"])
+        self.assertGreater(CatalogVersion.current().version, version)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.submit([]).status_code, 400)
+        self.assertEqual(self.submit(self.items(51)).status_code, 400)
+        self.assertEqual(self.submit([{"title": ""}]).status_code, 400)
+        self.assertEqual(Design.objects.count(), 0)
+
+
+class BookletCacheTests(CacheTestCase):
+    """Cached booklets are dropped when a design they contain, or its material or contributor, changes."""
+
+    def setUp(self):
+        super().setUp()
+        self.material = Material.objects.create(name="Wood")
+        self.contributor = Contributor.objects.create(name="Ada", email="ada@example.com")
+        self.design = Design.objects.create(
+            title="Wall", description="A description", material=self.material, contributor=self.contributor,
+            status="approved",
+        )
+        self.other_design = Design.objects.create(
+            title="Roof", description="A description", material=Material.objects.create(name="Clay"), status="approved"
+        )
+        self.booklet_cache = get_booklet_cache()
+
+    def cache_booklet(self, *designs):
+        design_ids = [design.id for design in designs]
+        spool_path = self.booklet_cache.spool()
+        with open(spool_path, "wb") as f:
+            f.write(b"%PDF-")
+        self.booklet_cache.set_file(design_ids, spool_path)
+        return design_ids
+
+    def assertDropped(self, change):
+        """change() drops the booklets with self.design and keeps the one without it."""
+        both = self.cache_booklet(self.design, self.other_design)
+        alone = self.cache_booklet(self.design)
+        other = self.cache_booklet(self.other_design)
+        change()
+        self.assertIsNone(self.booklet_cache.get_path(both))
+        self.assertIsNone(self.booklet_cache.get_path(alone))
+        self.assertIsNotNone(self.booklet_cache.get_path(other))
+
+    def test_design_save(self):
+        self.design.title = "Renamed"
+        self.assertDropped(self.design.save)
+
+    def test_design_bulk_update(self):
+        self.assertDropped(lambda: Design.objects.filter(id=self.design.id).update(title="Renamed"))
+
+    def test_material_change(self):
+        self.material.name = "Oak"
+        self.assertDropped(self.material.save)
+
+    def test_contributor_change(self):
+        self.contributor.name = "Grace"
+        self.assertDropped(self.contributor.save)
+
+    def test_contributor_delete(self):
+        self.assertDropped(self.contributor.delete)
+
+    def test_design_edited_during_build(self):
+        def build(approved_ids, stats, output):
+            self.design.title = "Renamed"
+            self.design.save()
+            with open(output, "wb") as f:
+                f.write(b"%PDF-")
+            stats["failed_design_ids"] = []
+
+        cached_booklet([self.design.id], build).close()
+        self.assertIsNone(self.booklet_cache.get_path([self.design.id]))
+
+    def test_markers_follow_evictions(self):
+        with mock.patch.object(self.booklet_cache.store, "max_size", 0):
+            self.cache_booklet(self.design, self.other_design)
+        self.assertEqual(list(self.booklet_cache.store.keys()), [])
+        for design in (self.design, self.other_design):
+            self.assertEqual(os.listdir(os.path.join(self.booklet_cache.members_dir, str(design.id))), [])
+        self.assertEqual(os.listdir(self.booklet_cache.selections_dir), [])
+
+
+class BookletOutputTests(CacheTestCase):
+    """Booklets merged from cached fragments are about as small as booklets rendered in one document."""
+
+    def setUp(self):
+        super().setUp()
+        material = Material.objects.create(name="Wood")
+        contributor = Contributor.objects.create(name="Ada", email="ada@example.com")
+        self.design_ids = [
+            Design.objects.create(
+                title=f"Frame {number}", description="A timber frame filled with straw bales. " * 5,
+                material=material, contributor=contributor, status="approved",
+            ).id
+            for number in range(10)
+        ]
+
+    def render(self, fragment_cache):
+        """The size of the design pages and the number of font objects of the booklet."""
+        with override_settings(BOOKLET_FRAGMENT_CACHE=fragment_cache):
+            # The first build fills the fragment cache
+            generate_booklet(self.design_ids)
+            booklet = generate_booklet(self.design_ids).getvalue()
+            without_designs = generate_booklet([]).getvalue()
+        doc = fitz.open(stream=booklet, filetype="pdf")
+        fonts = sum(1 for xref in range(1, doc.xref_length()) if doc.xref_get_key(xref, "Type")[1] == "/Font")
+        doc.close()
+        return len(booklet) - len(without_designs), fonts
+
+    def test_fragments_share_fonts(self):
+        for profile in SAVE_PROFILES:
+            with self.subTest(profile), override_settings(BOOKLET_SAVE_PROFILE=profile):
+                size, fonts = self.render({"BACKEND": "nahbah.utils.fragment_cache.DummyFragmentCache"})
+                fragments_size, fragments_fonts = self.render({
+                    "BACKEND": "nahbah.utils.fragment_cache.DiskFragmentCache",
+                    "LOCATION": f"{settings.BOOKLET_CACHE_DIR}/fragments-{profile}",
+                    "MAX_SIZE": 64 * 1024 * 1024,
+                })
+                self.assertEqual(fragments_fonts, fonts)
+                self.assertLess(fragments_size, size * 1.1)
+
+
+class RenderPoolTests(CacheTestCase):
+    """Designs rendered in the render pool end up in the booklet like designs rendered in-process."""
+
+    def setUp(self):
+        super().setUp()
+        material = Material.objects.create(name="Wood")
+        self.design_ids = [
+            Design.objects.create(title=f"Frame {number}", description="", material=material, status="approved").id
+            for number in range(5)
+        ]
+
+    def page_texts(self, booklet):
+        doc = fitz.open(stream=booklet.getvalue(), filetype="pdf")
+        texts = [page.get_text() for page in doc]
+        doc.close()
+        return texts
+
+    def test_same_booklet_as_in_process(self):
+        in_process = self.page_texts(generate_booklet(self.design_ids))
+        self.addCleanup(discard_render_pool)
+        with override_settings(BOOKLET_RENDER_WORKERS=2):
+            stats = {}
+            in_pool = self.page_texts(generate_booklet(self.design_ids, stats=stats))
+        self.assertEqual(in_pool, in_process)
+        self.assertEqual(stats["failed_design_ids"], [])
+        self.assertIn("render", stats["timings"])
+
+    def test_dead_worker(self):
+        """When a worker dies the designs are rendered in-process instead."""
+        def submit(*args):
+            future = Future()
+            future.set_exception(BrokenProcessPool())
+            return future
+
+        expected = self.page_texts(generate_booklet(self.design_ids))
+        pool = SimpleNamespace(submit=submit)
+        with override_settings(BOOKLET_RENDER_WORKERS=2), \
+                mock.patch("nahbah.utils.generate_booklet.get_render_pool", return_value=pool), \
+                mock.patch("nahbah.utils.generate_booklet.discard_render_pool") as discard_render_pool:
+            stats = {}
+            booklet = generate_booklet(self.design_ids, stats=stats)
+        self.assertEqual(self.page_texts(booklet), expected)
+        self.assertEqual(stats["failed_design_ids"], [])
+        self.assertEqual(discard_render_pool.call_count, 5)
+
+
+class MasterBookletTests(CacheTestCase):
+    """Booklets assembled from the master booklet, and the master kept in step with the designs."""
+
+    def setUp(self):
+        super().setUp()
+        self.material = Material.objects.create(name="Wood")
+        self.designs = [self.create_design(f"Design {number}") for number in range(3)]
+        self.master_booklet = get_master_booklet()
+        self.master_booklet.rebuild()
+
+    def create_design(self, title, status="approved"):
+        return Design.objects.create(title=title, description="A description", material=self.material, status=status)
+
+    def extract(self, designs):
+        stats = {}
+        booklet = fitz.open(stream=self.master_booklet.extract([design.id for design in designs], stats=stats))
+        page_count = len(booklet)
+        booklet.close()
+        return page_count, stats["failed_design_ids"]
+
+    def test_readers_dont_wait_for_writers(self):
+        opened = []
+
+        def read():
+            master_file, _ = self.master_booklet.open()
+            master_file.close()
+            opened.append(True)
+
+        with self.master_booklet._writing():
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join(5)
+        self.assertEqual(opened, [True], "open() waited for the writer")
+
+    def test_extract(self):
+        first, _, last = self.designs
+        page_count, failed_design_ids = self.extract([first, last])
+        index = self.master_booklet._load_index()
+        self.assertEqual(page_count, index["page_count"] - index["entries"][1]["pages"])
+        self.assertEqual(failed_design_ids, [])
+
+    def test_extract_reports_designs_missing_from_the_master(self):
+        changed, unchanged, _ = self.designs
+        Design.objects.filter(id=changed.id).update(title="Renamed")
+        added = self.create_design("Added")
+        page_count, failed_design_ids = self.extract([changed, unchanged, added])
+        self.assertEqual(failed_design_ids, [changed.id, added.id])
+        # Every design has the same number of pages, so this is the master with all three
+        self.assertEqual(page_count, self.master_booklet._load_index()["page_count"])
+
+    def assertMasterTitles(self, titles):
+        """The master booklet has these designs in this order, each at the page range its index entry records."""
+        index = self.master_booklet._load_index()
+        master = fitz.open(self.master_booklet.pdf_path)
+        self.assertEqual(len(master), index["page_count"])
+        self.assertEqual(
+            index["page_count"],
+            index["prefix_pages"] + sum(entry["pages"] for entry in index["entries"]) + index["suffix_pages"],
+        )
+        self.assertEqual([entry["id"] for entry in index["entries"]], sorted(entry["id"] for entry in index["entries"]))
+        for position, title in enumerate(titles):
+            self.assertIn(title, master[self.master_booklet._start_page(index, position)].get_text())
+        self.assertEqual(len(index["entries"]), len(titles))
+        master.close()
+
+    def test_sync(self):
+        first, second, third = self.designs
+        pending = self.create_design("Pending", status="pending")
+        self.assertMasterTitles(["Design 0", "Design 1", "Design 2"])
+
+        Design.objects.filter(id=pending.id).update(status="approved")
+        self.master_booklet.sync([pending.id])
+        self.assertMasterTitles(["Design 0", "Design 1", "Design 2", "Pending"])
+
+        second.title = "Renamed"
+        second.save()
+        self.master_booklet.sync([second.id])
+        self.assertMasterTitles(["Design 0", "Renamed", "Design 2", "Pending"])
+
+        deleted_id = first.id
+        first.delete()
+        Design.objects.filter(id=third.id).update(status="rejected")
+        self.master_booklet.sync([deleted_id, third.id])
+        self.assertMasterTitles(["Renamed", "Pending"])
+        index = self.master_booklet._load_index()
+        self.assertEqual(self.extract([second]), (index["page_count"] - index["entries"][1]["pages"], []))
+
+
+class MasterBookletDownloadTests(CacheTestCase):
+    """Booklets of all designs and of a material are not rendered in the request while the master is built."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.material = Material.objects.create(name="Wood")
+        Design.objects.create(title="Wall", description="A description", material=self.material, status="approved")
+        patcher = mock.patch("nahbah.views.schedule_master_build")
+        self.schedule_master_build = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self, **params):
+        response = self.client.get("/api/designs/download_booklet/", params)
+        if response.streaming:
+            b"".join(response.streaming_content)  # Closes the file
+        return response
+
+    def test_all_designs_wait_for_the_master(self):
+        response = self.download(all="1")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], str(settings.BOOKLET_RETRY_AFTER))
+        self.schedule_master_build.assert_called_once()
+
+        get_master_booklet().build()
+        self.assertEqual(self.download(all="1").status_code, 200)
+
+    def test_material_is_rendered_without_the_master(self):
+        response = self.download(material=str(self.material.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.schedule_master_build.assert_called_once()
+
+
+class RenderLimitTests(CacheTestCase):
+    """Concurrent identical requests share one render, and requests beyond the render slots are turned away."""
+
+    def setUp(self):
+        super().setUp()
+        material = Material.objects.create(name="Wood")
+        self.design = Design.objects.create(title="Wall", description="", material=material, status="approved")
+
+    def test_single_flight_shares_one_render(self):
+        builds, contents = [], []
+        started = threading.Event()
+
+        def build(approved_ids, stats, output):
+            builds.append(approved_ids)
+            started.set()
+            time.sleep(0.3)  # Long enough for the other request to wait for this render
+            with open(output, "wb") as f:
+                f.write(b"%PDF-")
+            stats["failed_design_ids"] = []
+
+        def download():
+            with cached_booklet([self.design.id], build) as booklet_file:
+                contents.append(booklet_file.read())
+
+        coalesced = render_limit_stats()["coalesced"]
+        # The thread has its own database connection, which can't see the test's transaction
+        catalog_version = mock.patch("nahbah.views.CatalogVersion.current", return_value=CatalogVersion(version=1))
+        with catalog_version:
+            first = threading.Thread(target=download)
+            first.start()
+            started.wait(5)
+            download()
+            first.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(contents, [b"%PDF-", b"%PDF-"])
+        self.assertEqual(render_limit_stats()["coalesced"], coalesced + 1)
+
+    @override_settings(BOOKLET_MAX_CONCURRENT_RENDERS=2, BOOKLET_RETRY_AFTER=7)
+    def test_busy_when_render_slots_are_taken(self):
+        with ExitStack() as slots:
+            for _ in range(2):
+                slots.enter_context(render_slot())
+            response = APIClient().get("/api/designs/download_booklet/", {"design_ids": str(self.design.id)})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+
+class BookletJobTests(CacheTestCase):
+    """One active job per selection, and jobs of processes that exited are not left running."""
+
+    def setUp(self):
+        super().setUp()
+        material = Material.objects.create(name="Wood")
+        self.design = Design.objects.create(title="Wall", description="", material=material, status="approved")
+
+    def test_identical_selections_share_a_job(self):
+        job, created = submit_booklet_job([self.design.id])
+        self.assertTrue(created)
+        self.assertEqual(submit_booklet_job([self.design.id]), (job, False))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BookletJob.objects.create(selection_key=job.selection_key, design_ids=job.design_ids)
+
+        BookletJob.objects.filter(id=job.id).update(status="done", finished_at=timezone.now())
+        self.assertTrue(submit_booklet_job([self.design.id])[1])
+
+    def test_orphaned_jobs_fail(self):
+        host = socket.gethostname()
+        live_worker, exited_worker = f"{host}-1-live", f"{host}-2-exited"
+        os.makedirs(f"{settings.BOOKLET_JOB_DIR}/workers")
+        with open(f"{settings.BOOKLET_JOB_DIR}/workers/{live_worker}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            jobs = {
+                worker: BookletJob.objects.create(selection_key=worker, status="running", worker=worker)
+                for worker in [get_worker(), live_worker, exited_worker, "elsewhere-3-exited"]
+            }
+            fail_orphaned_jobs()
+        statuses = {worker: BookletJob.objects.get(id=job.id).status for worker, job in jobs.items()}
+        self.assertEqual(statuses, {
+            get_worker(): "running",
+            live_worker: "running",
+            exited_worker: "failed",
+            "elsewhere-3-exited": "running",
+        })
+
+    @override_settings(BOOKLET_JOB_QUEUE_TIMEOUT=60, BOOKLET_JOB_TIMEOUT=600)
+    def test_timeouts(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        jobs = {
+            name: BookletJob.objects.create(selection_key=name, status=status, started_at=started_at)
+            for name, status, started_at in [
+                ("queued", "queued", None),
+                ("started recently", "running", timezone.now()),
+                ("started long ago", "running", long_ago),
+            ]
+        }
+        # Every job was queued an hour ago
+        BookletJob.objects.update(created_at=long_ago)
+        expire_stale_jobs()
+        jobs = {name: BookletJob.objects.get(id=job.id) for name, job in jobs.items()}
+        self.assertEqual(jobs["queued"].status, "failed")
+        self.assertEqual(jobs["queued"].error, "The job waited too long for a worker.")
+        self.assertEqual(jobs["started recently"].status, "running")
+        self.assertEqual(jobs["started long ago"].status, "failed")
+        self.assertEqual(jobs["started long ago"].error, "The job timed out.")
+
+    def run_job(self, generate_booklet):
+        """Run a queued job of the design with generate_booklet in place of the renderer."""
+        job = BookletJob.objects.create(selection_key="wall", design_ids=[self.design.id])
+        # The job's thread closes its own connection, not the test's
+        with mock.patch("nahbah.utils.booklet_jobs.generate_booklet", side_effect=generate_booklet), \
+                mock.patch("nahbah.utils.booklet_jobs.connection"):
+            run_booklet_job(job.id)
+        return BookletJob.objects.get(id=job.id)
+
+    def test_done(self):
+        def generate_booklet(design_ids, stats, output):
+            stats.update(failed_design_ids=[], timings={"total": 1})
+            with open(output, "wb") as f:
+                f.write(b"%PDF")
+
+        job = self.run_job(generate_booklet)
+        self.assertEqual((job.status, job.timings), ("done", {"total": 1}))
+        self.assertTrue(os.path.exists(job.file_path))
+
+    def test_failed_job_leaves_no_file(self):
+        def generate_booklet(design_ids, stats, output):
+            with open(output, "wb") as f:
+                f.write(b"%PDF-partial")
+            raise RuntimeError("out of memory")
+
+        with self.assertLogs("nahbah.utils.booklet_jobs", "ERROR"):
+            job = self.run_job(generate_booklet)
+        self.assertEqual((job.status, job.error), ("failed", "out of memory"))
+        self.assertFalse(os.path.exists(job_file_path(job)))
+
+    def test_timed_out_job_stays_failed(self):
+        def generate_booklet(design_ids, stats, output):
+            stats.update(failed_design_ids=[], timings={})
+            with open(output, "wb") as f:
+                f.write(b"%PDF")
+            # expire_stale_jobs() in another request gives up on the job meanwhile
+            BookletJob.objects.filter(status="running").update(status="failed", error="The job timed out.")
+
+        job = self.run_job(generate_booklet)
+        self.assertEqual((job.status, job.error, job.file_path), ("failed", "The job timed out.", ""))
+        self.assertFalse(os.path.exists(job_file_path(job)))
+
+
+@override_settings(BOOKLET_IMAGE_PROFILE={"DPI": 100, "QUALITY": 80})
+class ImageIngestTests(SimpleTestCase):
+    """Design images are embedded at the print size of their page, the right way up."""
+
+    # Where add_design_file_pages() places an image on its page
+    rect = fitz.Rect(10, 10, A6[0] - 10, A6[1] - 10)
+
+    def setUp(self):
+        self.max_size = target_size(self.rect, 100)
+
+    @staticmethod
+    def image(size, format="JPEG", mode="RGB", orientation=None):
+        image = Image.new(mode, size, "white")
+        # Something to compress, so downscaled images get smaller
+        for x in range(0, size[0], 7):
+            image.putpixel((x, x * size[1] // size[0]), (200, 30, 30, 255)[:len(mode)])
+        exif = Image.Exif()
+        if orientation is not None:
+            exif[0x0112] = orientation
+        stream = BytesIO()
+        image.save(stream, format=format, exif=exif)
+        return stream.getvalue()
+
+    def page_image(self, data):
+        """Add data like a design file and return the page and its image's (width, height) in pixels."""
+        doc = fitz.open()
+        self.addCleanup(doc.close)
+        self.assertTrue(add_design_file_pages(SimpleNamespace(design_file="designs/image"), doc, data))
+        self.assertEqual(len(doc), 1)
+        page = doc[0]
+        self.assertAlmostEqual(page.rect.width, A6[0], places=3)
+        self.assertAlmostEqual(page.rect.height, A6[1], places=3)
+        (xref, _, width, height, *_), = page.get_images()
+        # Placed inside the rect, keeping its proportions
+        placed = page.get_image_rects(xref)[0]
+        self.assertTrue(self.rect.contains(placed))
+        self.assertAlmostEqual(placed.width / placed.height, width / height, places=2)
+        return page, (width, height)
+
+    def test_passthrough(self):
+        data = self.image((400, 200))
+        result, info = ingest_image(data, self.rect)
+        self.assertIs(result, data)
+        self.assertEqual((info["mode"], info["bytes_saved"]), ("passthrough", 0))
+        self.assertEqual(self.page_image(data)[1], (400, 200))
+
+    def test_downscale_above_print_size(self):
+        for format, mode in [("JPEG", "RGB"), ("PNG", "RGBA")]:
+            with self.subTest(format):
+                data = self.image((self.max_size[0] * 3, self.max_size[1]), format=format, mode=mode)
+                result, info = ingest_image(data, self.rect)
+                self.assertEqual(info["mode"], "downscaled")
+                self.assertEqual(info["bytes_saved"], len(data) - len(result))
+                self.assertGreater(info["bytes_saved"], 0)
+                size = (self.max_size[0], round(self.max_size[1] / 3))
+                with Image.open(BytesIO(result)) as image:
+                    # PNGs and transparency stay PNG
+                    self.assertEqual((image.format, image.size), (format, size))
+                self.assertEqual(self.page_image(data)[1], size)
+
+    def test_exif_orientation(self):
+        # Orientation 6: stored sideways, displayed rotated 90 degrees clockwise
+        data = self.image((300, 100), orientation=6)
+        result, info = ingest_image(data, self.rect)
+        self.assertEqual(info["mode"], "downscaled")
+        with Image.open(BytesIO(result)) as image:
+            self.assertEqual(image.size, (100, 300))
+            self.assertEqual(image.getexif().get(0x0112, 1), 1)
+        self.assertEqual(self.page_image(data)[1], (100, 300))
+
+    def test_unsupported_format(self):
+        data = b"<svg xmlns='http://www.w3.org/2000/svg'/>"
+        self.assertEqual(ingest_image(data, self.rect), (data, {
+            "original_bytes": len(data), "bytes": len(data), "bytes_saved": 0, "mode": "passthrough",
+        }))
+        # Left to PyMuPDF, which can't read it either: an error page instead of the image
+        doc = fitz.open()
+        self.addCleanup(doc.close)
+        self.assertFalse(add_design_file_pages(SimpleNamespace(design_file="designs/image"), doc, data))
+        self.assertIn("Error loading design file", doc[-1].get_text())
+
+
+class QRCodeTests(SimpleTestCase):
+    """QR codes are memoized per URL and drawn as vector shapes or embedded as an image."""
+
+    url = "https://example.com/plans?design=7"
+    rect = fitz.Rect(20, 20, 90, 90)
+
+    def page(self):
+        doc = fitz.open()
+        self.addCleanup(doc.close)
+        return doc.new_page(width=A6[0], height=A6[1])
+
+    def test_memoized(self):
+        qr_matrix.cache_clear()
+        self.assertIs(qr_matrix(self.url), qr_matrix(self.url))
+        self.assertEqual(qr_matrix.cache_info().hits, 1)
+
+    @override_settings(BOOKLET_QR_MODE="vector")
+    def test_vector(self):
+        page = self.page()
+        insert_qr_code(page, self.rect, self.url)
+        self.assertEqual(page.get_images(), [])
+        # Filled rectangles inside rect covering one module's area per dark module
+        matrix = qr_matrix(self.url)
+        module = self.rect.width / len(matrix)
+        drawn = [item[1] for drawing in page.get_drawings() for item in drawing["items"] if item[0] == "re"]
+        self.assertTrue(all(self.rect.contains(rect) for rect in drawn))
+        area = sum(rect.width * rect.height for rect in drawn)
+        self.assertAlmostEqual(area, sum(map(sum, matrix)) * module * module, places=2)
+
+    @override_settings(BOOKLET_QR_MODE="raster")
+    def test_raster(self):
+        page = self.page()
+        insert_qr_code(page, self.rect, self.url)
+        (xref, _, width, height, *_), = page.get_images()
+        self.assertEqual(width, height)
+        self.assertEqual(page.get_image_rects(xref), [self.rect])
+        self.assertEqual(page.get_drawings(), [])
+
+
+class DiskLRUCacheTests(SimpleTestCase):
+    """Eviction order, eviction callbacks and when the cache directory is listed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="nahbah-tests-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.evicted = []
+        self.cache = DiskLRUCache(self.directory, 30, suffix=".bin", on_evict=self.evicted.append)
+
+    def set_used(self, key, seconds_ago):
+        """Store a 10 byte entry last used seconds_ago."""
+        path = self.cache.set(key, b"0123456789")
+        used = time.time() - seconds_ago
+        os.utime(path, (used, used))
+
+    def test_least_recently_used_go_first(self):
+        self.set_used("a", 30)
+        self.set_used("b", 20)
+        self.set_used("c", 10)
+        self.assertEqual(self.cache.get("a"), b"0123456789")
+        self.set_used("d", 0)
+        self.assertEqual(sorted(self.cache.keys()), ["a", "c", "d"])
+        self.cache.set("e", b"0123456789" * 2)
+        self.assertEqual(sorted(self.cache.keys()), ["d", "e"])
+        self.assertEqual(self.evicted, ["b", "c", "a"])
+
+    def test_lists_the_directory_only_when_full(self):
+        with mock.patch.object(self.cache, "_entries", wraps=self.cache._entries) as entries:
+            # Counted on disk once, then kept up to date
+            self.cache.set("a", b"0123456789")
+            self.cache.set("a", b"01234")
+            self.cache.set("b", b"0123456789")
+            self.cache.delete("b")
+            self.cache.set("c", b"0123456789")
+            self.assertEqual(entries.call_count, 1)
+            self.cache.set("d", b"0123456789" * 2)
+            self.assertEqual(entries.call_count, 2)
+        self.assertEqual(sorted(self.cache.keys()), ["c", "d"])
+        self.assertEqual(self.cache.size(), 30)
+
+    def test_catches_up_with_other_processes(self):
+        self.set_used("a", 10)
+        # Written by another process, whose own count is still under max_size
+        with open(os.path.join(self.directory, "b.bin"), "wb") as f:
+            f.write(b"0123456789" * 2)
+        self.cache.set("c", b"0")
+        self.assertEqual(sorted(self.cache.keys()), ["a", "b", "c"])
+        with mock.patch("nahbah.utils.disk_cache.time.monotonic", return_value=time.monotonic() + RESCAN_INTERVAL):
+            self.cache.set("c", b"0")
+        self.assertEqual(sorted(self.cache.keys()), ["b", "c"])
+        self.assertEqual(self.evicted, ["a"])
+
+
+class FragmentKeyTests(SimpleTestCase):
+    """A design's fragment key changes with everything rendered into its pages, and only with that."""
+
+    @staticmethod
+    def design(**changes):
+        fields = {
+            "id": 7,
+            "title": "Frame",
+            "description": "A frame",
+            "material": SimpleNamespace(name="Wood"),
+            "contributor": SimpleNamespace(name="Ada"),
+            "design_file": SimpleNamespace(public_id="designs/frame", version="1"),
+            "status": "approved",
+        }
+        return SimpleNamespace(**{**fields, **changes})
+
+    def test_changes(self):
+        key = fragment_key(self.design())
+        self.assertTrue(key.startswith("7-"))
+        self.assertEqual(fragment_key(self.design(status="pending")), key)
+        for changes in [
+            {"title": "Wall"},
+            {"description": "A wall"},
+            {"material": SimpleNamespace(name="Straw")},
+            {"contributor": SimpleNamespace(name="Grace")},
+            {"contributor": None},
+            {"design_file": SimpleNamespace(public_id="designs/frame", version="2")},
+            {"design_file": SimpleNamespace(public_id="designs/wall", version="1")},
+            {"design_file": None},
+        ]:
+            with self.subTest(changes):
+                self.assertNotEqual(fragment_key(self.design(**changes)), key)
+        for setting in [{"BASE_URL": "https://example.org"}, {"BOOKLET_QR_MODE": "raster"}]:
+            with self.subTest(setting), override_settings(**setting):
+                self.assertNotEqual(fragment_key(self.design()), key)
+
+    def test_delete_design(self):
+        directory = tempfile.mkdtemp(prefix="nahbah-tests-")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        fragment_cache = DiskFragmentCache(directory, 1024)
+        keys = [fragment_key(self.design()), fragment_key(self.design(title="Wall")), fragment_key(self.design(id=70))]
+        for key in keys:
+            fragment_cache.set(key, b"%PDF")
+        fragment_cache.delete_design(7)
+        self.assertEqual([fragment_cache.get(key) for key in keys], [None, None, b"%PDF"])
+
+
+class BackgroundRefreshTests(CacheTestCase):
+    """Approving a design pre-renders its booklet fragment and warms its preview, off the booklet job pool."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = settings.BOOKLET_CACHE_DIR
+        self.enterContext(override_settings(BOOKLET_FRAGMENT_CACHE={
+            "BACKEND": "nahbah.utils.fragment_cache.DiskFragmentCache",
+            "LOCATION": f"{cache_dir}/fragments",
+            "MAX_SIZE": 64 * 1024 * 1024,
+        }))
+        self.enterContext(mock.patch.object(cloudinary.config(), "cloud_name", "demo", create=True))
+        # Refreshes run right away in the test's thread, whose connection the refresh must not close
+        executor = SimpleNamespace(submit=lambda function, *args: function(*args))
+        self.enterContext(mock.patch("nahbah.utils.booklet_jobs.get_refresh_executor", return_value=executor))
+        self.enterContext(mock.patch("nahbah.utils.booklet_jobs.connection"))
+        self.warm_url = self.enterContext(mock.patch("nahbah.utils.booklet_jobs.warm_url"))
+        design_file = fitz.open()
+        design_file.new_page()
+        self.enterContext(mock.patch(
+            "nahbah.utils.generate_booklet.fetch_design_file", return_value=design_file.tobytes()
+        ))
+        design_file.close()
+
+        material = Material.objects.create(name="Wood")
+        self.designs = [
+            Design.objects.create(
+                title=f"Frame {number}", description="", material=material,
+                design_file=f"designs/frame{number}.pdf", status="pending",
+            )
+            for number in range(2)
+        ]
+
+    def fragment(self, design):
+        design = Design.objects.select_related("material", "contributor").get(pk=design.pk)
+        return get_fragment_cache().get(fragment_key(design))
+
+    def test_moderation(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "password"))
+        approved, rejected = self.designs
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f"/api/designs/{approved.id}/moderate/", {"status": "approved"})
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.patch(f"/api/designs/{rejected.id}/moderate/", {"status": "rejected", "rejection_reason": "Blurry"})
+
+        self.assertIsNotNone(self.fragment(approved))
+        self.assertIsNone(self.fragment(rejected))
+        preview_url = Design.objects.get(pk=approved.pk).preview_url
+        self.assertTrue(preview_url)
+        self.warm_url.assert_called_once_with(preview_url)
+
+    def test_admin_action(self):
+        # approve_designs() updates the queryset, bypassing save()
+        with self.captureOnCommitCallbacks(execute=True), mock.patch("nahbah.admin.messages"):
+            approve_designs(None, RequestFactory().post("/"), Design.objects.filter(pk=self.designs[0].pk))
+        self.assertIsNotNone(self.fragment(self.designs[0]))
+        self.assertIsNone(self.fragment(self.designs[1]))
+        self.assertEqual(self.warm_url.call_count, 1)
+
+    def test_refreshes_have_their_own_pool(self):
+        jobs, refreshes = mock.Mock(), mock.Mock()
+        with mock.patch("nahbah.utils.booklet_jobs.get_executor", return_value=jobs), \
+                mock.patch("nahbah.utils.booklet_jobs.get_refresh_executor", return_value=refreshes), \
+                mock.patch("nahbah.utils.booklet_jobs._master_build", None), \
+                self.captureOnCommitCallbacks(execute=True):
+            schedule_design_refresh([self.designs[0].id])
+            schedule_master_build()
+            submit_booklet_job([self.designs[0].id])
+        self.assertEqual(refreshes.submit.call_count, 2)
+        self.assertEqual(jobs.submit.call_count, 1)
+
+
+class DesignFileCacheTests(SimpleTestCase):
+    """Revalidation of expired design files falls back to the copy on disk only when Cloudinary is down."""
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp(prefix="nahbah-tests-")
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.cache = DesignFileCache(cache_dir, 1024 * 1024)
+        self.design_file = SimpleNamespace(public_id="designs/wall", version=None, url="https://example.com/wall.pdf")
+        self.store()
+
+    def store(self):
+        # Expires straight away, so every later fetch revalidates
+        self.cache.fetch(self.design_file, fetch=lambda url, headers=None: FetchedFile(200, {}, b"wall"))
+
+    @staticmethod
+    def failing_fetch(error):
+        def fetch(url, headers=None):
+            raise error
+        return fetch
+
+    @staticmethod
+    def http_error(status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        return requests.HTTPError(response=response)
+
+    def test_stale_on_network_errors_and_5xx(self):
+        for error in (requests.ConnectionError(), CircuitOpenError("down"), self.http_error(503)):
+            self.assertEqual(self.cache.fetch(self.design_file, fetch=self.failing_fetch(error)), b"wall")
+        self.assertEqual(self.cache.stats()["stale"], 3)
+
+    def test_gone_drops_the_entry(self):
+        for status_code in (404, 410):
+            self.store()
+            with self.assertRaises(requests.HTTPError):
+                self.cache.fetch(self.design_file, fetch=self.failing_fetch(self.http_error(status_code)))
+            self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_other_client_errors_raise(self):
+        with self.assertRaises(requests.HTTPError):
+            self.cache.fetch(self.design_file, fetch=self.failing_fetch(self.http_error(403)))
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+
+@override_settings(BOOKLET_FETCH_CONCURRENCY=2)
+class DesignFetchTests(SimpleTestCase):
+    """iter_design_files() downloads ahead of the renderer in a bounded window and keeps the design order."""
+
+    def setUp(self):
+        self.designs = [SimpleNamespace(id=number, design_file=f"designs/{number}") for number in range(1, 21)]
+        self.started = []
+        self.enterContext(mock.patch("nahbah.utils.generate_booklet.fetch_design_file", side_effect=self.fetch))
+
+    def fetch(self, design):
+        self.started.append(design.id)
+        if design.id == 3:
+            raise requests.ConnectionError("down")
+        return f"file {design.id}".encode()
+
+    def test_window(self):
+        consumed = 0
+        for design, file_content in iter_design_files(self.designs):
+            consumed += 1
+            if design.id != 3:
+                self.assertEqual(file_content, f"file {design.id}".encode())
+            # Twice BOOKLET_FETCH_CONCURRENCY files are downloaded ahead at most
+            self.assertLessEqual(len(self.started), consumed + 4)
+        self.assertEqual(consumed, 20)
+
+    def test_order_errors_and_skipped_designs(self):
+        self.designs[4].design_file = None
+        fragments = {design.id: b"fragment" if design.id % 5 == 0 else None for design in self.designs}
+        results = list(iter_design_files(self.designs, fragments))
+        self.assertEqual([design.id for design, _ in results], list(range(1, 21)))
+        self.assertIsInstance(results[2][1], requests.ConnectionError)
+        self.assertIsNone(results[4][1])
+        self.assertIsNone(results[9][1])
+        self.assertEqual(results[5][1], b"file 6")
+        self.assertEqual(sorted(self.started), [number for number in range(1, 21) if number % 5])
+
+    def test_stopping_early(self):
+        design_files = iter_design_files(self.designs)
+        next(design_files)
+        design_files.close()
+        self.assertLessEqual(len(self.started), 5)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(
+    BOOKLET_FETCH_RETRIES=2,
+    BOOKLET_FETCH_RETRY_BACKOFF=0.5,
+    BOOKLET_FETCH_BREAKER={"FAILURE_THRESHOLD": 3, "RESET_TIMEOUT": 30},
+)
+class RemoteFetchTests(SimpleTestCase):
+    """The circuit breaker states, and retries with backoff of failed downloads."""
+
+    def setUp(self):
+        # Breakers are kept per host for the whole process, so every test gets its own host
+        self.url = f"https://{self.id().rsplit('.', 1)[-1].replace('_', '-')}.example.com/design.pdf"
+        self.sleeps = []
+        patcher = mock.patch("nahbah.utils.remote_files.time.sleep", self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_attempt(self, *outcomes):
+        """Patch the HTTP request of download() to raise or return outcomes in turn."""
+        outcomes = list(outcomes)
+
+        def attempt(url, headers):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        patcher = mock.patch("nahbah.utils.remote_files._attempt", side_effect=attempt)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    @staticmethod
+    def http_error(status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        return requests.HTTPError(response=response)
+
+    def test_breaker_states(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker("example.com", failure_threshold=2, reset_timeout=30, clock=clock)
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        clock.now += 30
+        breaker.before_request()
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()  # Only one trial request at a time
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+        clock.now += 29
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        clock.now += 1
+        breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.stats()["times_opened"], 2)
+        self.assertEqual(breaker.stats()["rejected"], 3)
+
+    def test_retries_with_backoff(self):
+        fetched = FetchedFile(200, {}, b"design")
+        attempt = self.fake_attempt(requests.ConnectionError(), self.http_error(503), fetched)
+        self.assertEqual(download(self.url), fetched)
+        self.assertEqual(attempt.call_count, 3)
+        self.assertEqual(len(self.sleeps), 2)
+        for retry, delay in enumerate(self.sleeps):
+            self.assertLessEqual(delay, 0.5 * 2 ** retry)
+        self.assertEqual(get_circuit_breaker(self.url).state, "closed")
+
+    def test_gives_up_and_opens_the_breaker(self):
+        attempt = self.fake_attempt(*[requests.Timeout()] * 3)
+        with self.assertRaises(requests.Timeout):
+            download(self.url)
+        self.assertEqual(attempt.call_count, 3)
+        self.assertEqual(get_circuit_breaker(self.url).state, "open")
+        with self.assertRaises(CircuitOpenError):
+            download(self.url)
+        self.assertEqual(attempt.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        attempt = self.fake_attempt(self.http_error(404))
+        with self.assertRaises(requests.HTTPError):
+            download(self.url)
+        self.assertEqual(attempt.call_count, 1)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(get_circuit_breaker(self.url).consecutive_failures, 0)
+
+
+class RangeRequestTests(SimpleTestCase):
+    """Resumable downloads: Range and If-Range handling of ranged_file_response."""
+
+    def setUp(self):
+        self.content = bytes(range(100))
+        fd, self.path = tempfile.mkstemp(prefix="nahbah-tests-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.content)
+        self.addCleanup(os.remove, self.path)
+
+    def get(self, **headers):
+        request = RequestFactory().get("/booklet.pdf", **headers)
+        file = open(self.path, "rb")
+        self.addCleanup(file.close)
+        response = ranged_file_response(request, file, "booklet.pdf", "application/pdf")
+        return response, b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_parse_range(self):
+        cases = {
+            "bytes=0-9": (0, 9),
+            "bytes=90-": (90, 99),
+            "bytes=90-1000": (90, 99),
+            "bytes=-10": (90, 99),
+            "bytes=-500": (0, 99),
+            "bytes=-0": False,
+            "bytes=100-": False,
+            "bytes=5-2": None,
+            "bytes=-": None,
+            "bytes=0-1,5-6": None,
+            "items=0-9": None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 100), expected)
+
+    def test_range(self):
+        response, body = self.get(HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(body, self.content[10:20])
+
+    def test_suffix_range(self):
+        response, body = self.get(HTTP_RANGE="bytes=-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 95-99/100")
+        self.assertEqual(body, self.content[-5:])
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE="bytes=100-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_if_range(self):
+        etag = self.get()[0]["ETag"]
+        response, body = self.get(HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE=etag)
+        self.assertEqual((response.status_code, body), (206, self.content[10:20]))
+        response, body = self.get(HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"changed"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response, body = self.get(HTTP_RANGE="bytes=0-9,20-29")
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
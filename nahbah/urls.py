@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ContributorViewSet, DesignViewSet, MaterialViewSet
+from .views import BookletJobViewSet, ContributorViewSet, DesignViewSet, MaterialViewSet
 
 router = DefaultRouter()
 router.register(r"materials", MaterialViewSet, basename="material")
 router.register(r"designs", DesignViewSet, basename="design")
 router.register(r"contributors", ContributorViewSet)
+router.register(r"booklet-jobs", BookletJobViewSet, basename="bookletjob")
 
 urlpatterns = router.urls
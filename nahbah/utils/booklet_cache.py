@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from django.conf import settings
+
+from nahbah.utils.disk_cache import DiskLRUCache
+from nahbah.utils.fragment_cache import rendering_signature
+
+_booklet_cache = None
+
+
+class BookletCache:
+    """
+    Finished booklet PDFs on local disk, keyed by the normalized set of
+    approved design ids and the catalog version.
+
+    For every cached booklet an empty marker file is written under
+    members/<design_id>/ so that all booklets containing a design can be
+    invalidated without scanning the whole cache, and the design ids are
+    listed in selections/<key>, so the markers of an evicted or invalidated
+    booklet are removed with it.
+    """
+
+    def __init__(self, location, max_size):
+        self.store = DiskLRUCache(location, max_size, suffix=".pdf", on_evict=self.remove_markers)
+        self.members_dir = os.path.join(location, "members")
+        self.selections_dir = os.path.join(location, "selections")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(design_ids):
+        return sorted(set(int(design_id) for design_id in design_ids))
+
+    def key(self, design_ids):
+        content = [
+            settings.BOOKLET_CATALOG_VERSION,
+            rendering_signature(),
+            self.normalize(design_ids),
+        ]
+        return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+    def get_path(self, design_ids):
+        """Return the path of the cached booklet for these design ids, or None."""
+        path = self.store.get_path(self.key(design_ids))
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def spool(self):
+        """Return a temporary path in the cache directory to write a booklet to before set_file()."""
+        return self.store.spool()
+
+    def set_file(self, design_ids, tmp_path):
+        """Move a booklet written to a spool() path into the cache and return its new path."""
+        key = self.key(design_ids)
+        design_ids = self.normalize(design_ids)
+        os.makedirs(self.selections_dir, exist_ok=True)
+        with open(os.path.join(self.selections_dir, key), "w") as f:
+            json.dump(design_ids, f)
+        for design_id in design_ids:
+            design_dir = os.path.join(self.members_dir, str(design_id))
+            os.makedirs(design_dir, exist_ok=True)
+            open(os.path.join(design_dir, key), "w").close()
+        return self.store.set_file(key, tmp_path)
+
+    def remove_markers(self, key):
+        """Remove the members/ markers and the selections/ entry of a booklet that is no longer cached."""
+        selection_path = os.path.join(self.selections_dir, key)
+        try:
+            with open(selection_path) as f:
+                design_ids = json.load(f)
+        except (FileNotFoundError, ValueError):
+            design_ids = []
+        for design_id in design_ids:
+            try:
+                os.remove(os.path.join(self.members_dir, str(design_id), key))
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(selection_path)
+        except FileNotFoundError:
+            pass
+
+    def invalidate_design(self, design_id):
+        """Drop every cached booklet that contains the given design."""
+        design_dir = os.path.join(self.members_dir, str(design_id))
+        if not os.path.isdir(design_dir):
+            return
+        for key in os.listdir(design_dir):
+            self.store.delete(key)
+            self.remove_markers(key)
+            try:
+                # In case the selections/ entry is missing
+                os.remove(os.path.join(design_dir, key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else None,
+            "entries": sum(1 for _ in self.store.keys()),
+            "size": self.store.size(),
+        }
+
+
+def get_booklet_cache():
+    global _booklet_cache
+    if _booklet_cache is None:
+        _booklet_cache = BookletCache(
+            settings.BOOKLET_RESULT_CACHE["LOCATION"],
+            settings.BOOKLET_RESULT_CACHE["MAX_SIZE"],
+        )
+    return _booklet_cache
@@ -0,0 +1,267 @@
+import fcntl
+import logging
+import os
+import shutil
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from nahbah.models import BookletJob, CatalogVersion, Design
+from nahbah.utils.booklet_cache import get_booklet_cache
+from nahbah.utils.generate_booklet import generate_booklet, prerender_design_fragment
+from nahbah.utils.master_booklet import get_master_booklet
+from nahbah.utils.remote_files import warm_url
+from nahbah.utils.render_limits import render_slot
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_refresh_executor = None
+_worker = None
+_worker_lock_file = None
+_worker_lock = threading.Lock()
+_master_build = None
+_master_build_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide thread pool that runs booklet jobs."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            return _executor
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BOOKLET_JOB_WORKERS,
+            thread_name_prefix="booklet-job",
+        )
+    # First use in this process: jobs left by processes that exited (a restart or a crash) will never finish
+    fail_orphaned_jobs()
+    return _executor
+
+
+def get_refresh_executor():
+    """
+    Return the process-wide thread pool for background refreshes (pre-rendering
+    and the master booklet), separate from the booklet jobs people are waiting for.
+    """
+    global _refresh_executor
+    with _executor_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=settings.BOOKLET_REFRESH_WORKERS,
+                thread_name_prefix="booklet-refresh",
+            )
+        return _refresh_executor
+
+
+def _worker_lock_path(worker):
+    return os.path.join(settings.BOOKLET_JOB_DIR, "workers", f"{worker}.lock")
+
+
+def get_worker():
+    """
+    Return the name of this process in BookletJob.worker. The process holds a lock
+    on a file of that name for as long as it runs, so other processes on this
+    machine can tell whether its jobs are still being worked on.
+    """
+    global _worker, _worker_lock_file
+    with _worker_lock:
+        if _worker is None:
+            worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            os.makedirs(os.path.dirname(_worker_lock_path(worker)), exist_ok=True)
+            _worker_lock_file = open(_worker_lock_path(worker), "a")
+            fcntl.flock(_worker_lock_file, fcntl.LOCK_EX)
+            _worker = worker
+    return _worker
+
+
+def fail_orphaned_jobs():
+    """Mark queued and running jobs of processes on this machine that have exited as failed."""
+    workers = (
+        BookletJob.objects.filter(status__in=["queued", "running"], worker__startswith=f"{socket.gethostname()}-")
+        .exclude(worker=get_worker())
+        .values_list("worker", flat=True)
+        .distinct()
+    )
+    for worker in workers:
+        with open(_worker_lock_path(worker), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Still running
+            BookletJob.objects.filter(status__in=["queued", "running"], worker=worker).update(
+                status="failed", error="The server restarted before the job finished.", finished_at=timezone.now()
+            )
+            os.remove(_worker_lock_path(worker))
+
+
+def job_file_path(job):
+    return os.path.join(settings.BOOKLET_JOB_DIR, f"{job.pk}.pdf")
+
+
+def expire_stale_jobs():
+    """
+    Mark jobs that have been queued for longer than BOOKLET_JOB_QUEUE_TIMEOUT, running
+    for longer than BOOKLET_JOB_TIMEOUT, or whose process has exited, as failed, and
+    delete finished jobs past BOOKLET_JOB_RETENTION.
+    """
+    fail_orphaned_jobs()
+    now = timezone.now()
+    BookletJob.objects.filter(
+        status="queued",
+        created_at__lt=now - timedelta(seconds=settings.BOOKLET_JOB_QUEUE_TIMEOUT),
+    ).update(status="failed", error="The job waited too long for a worker.", finished_at=now)
+    BookletJob.objects.filter(
+        status="running",
+        started_at__lt=now - timedelta(seconds=settings.BOOKLET_JOB_TIMEOUT),
+    ).update(status="failed", error="The job timed out.", finished_at=now)
+
+    expired = BookletJob.objects.filter(
+        status__in=["done", "failed"],
+        finished_at__lt=now - timedelta(seconds=settings.BOOKLET_JOB_RETENTION),
+    )
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+    expired.delete()
+
+
+def submit_booklet_job(design_ids):
+    """
+    Queue a booklet job for the approved designs among design_ids.
+    A selection that is already queued or running is not queued twice (a unique
+    constraint covers concurrent requests): the existing job is returned
+    instead. Returns (job, created).
+    """
+    expire_stale_jobs()
+
+    approved_ids = get_booklet_cache().normalize(
+        Design.objects.filter(id__in=design_ids, status="approved").values_list("id", flat=True)
+    )
+    selection_key = get_booklet_cache().key(approved_ids)
+
+    active_jobs = BookletJob.objects.filter(selection_key=selection_key, status__in=["queued", "running"])
+    while True:
+        job = active_jobs.first()
+        if job is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                job = BookletJob.objects.create(
+                    selection_key=selection_key, design_ids=approved_ids, worker=get_worker()
+                )
+            break
+        except IntegrityError:
+            pass  # Another request queued the same selection in the meantime
+
+    transaction.on_commit(lambda: get_executor().submit(run_booklet_job, job.pk))
+    return job, True
+
+
+def run_booklet_job(job_id):
+    """Render the booklet of a queued job into BOOKLET_JOB_DIR and record per-stage timings."""
+    try:
+        claimed = BookletJob.objects.filter(pk=job_id, status="queued").update(
+            status="running", started_at=timezone.now()
+        )
+        if not claimed:
+            return
+
+        job = BookletJob.objects.get(pk=job_id)
+        path = job_file_path(job)
+        try:
+            stats = {}
+            os.makedirs(settings.BOOKLET_JOB_DIR, exist_ok=True)
+            # Jobs wait for a free render slot rather than being turned away
+            with render_slot(blocking=True):
+                catalog_version = CatalogVersion.current().version
+                generate_booklet(job.design_ids, stats=stats, output=path)
+            # Like views.cached_booklet()
+            if not stats["failed_design_ids"] and CatalogVersion.current().version == catalog_version:
+                booklet_cache = get_booklet_cache()
+                spool_path = booklet_cache.spool()
+                shutil.copyfile(path, spool_path)
+                booklet_cache.set_file(job.design_ids, spool_path)
+            result = {"status": "done", "file_path": path, "timings": stats["timings"]}
+        except Exception as e:
+            logger.exception("Booklet job %s failed", job_id)
+            result = {"status": "failed", "error": str(e)}
+
+        # Only while the job is still running: expire_stale_jobs() may have failed it meanwhile
+        finished = BookletJob.objects.filter(pk=job_id, status="running").update(
+            finished_at=timezone.now(), **result
+        )
+        if (not finished or result["status"] == "failed") and os.path.exists(path):
+            # Nobody will download it, and a failed render may have left part of a PDF
+            os.remove(path)
+    finally:
+        # Worker threads open their own database connection
+        connection.close()
+
+
+def schedule_design_refresh(design_ids):
+    """
+    Once the current transaction commits, refresh everything derived from these
+    designs in the background: pre-render the booklet fragments of approved
+    designs, warm their previews and update the master booklet.
+    """
+    if not design_ids:
+        return
+    design_ids = list(design_ids)
+    transaction.on_commit(lambda: get_refresh_executor().submit(refresh_designs, design_ids))
+
+
+def refresh_designs(design_ids):
+    try:
+        if settings.BOOKLET_PRERENDER:
+            prerender_designs(design_ids)
+        get_master_booklet().sync(design_ids)
+    except Exception:
+        logger.exception("Refreshing designs %s failed", design_ids)
+    finally:
+        connection.close()
+
+
+def schedule_master_build():
+    """
+    Build the master booklet in the background, in a render slot like any other
+    render. Requests for it are answered without it meanwhile, and a build that
+    is already under way in this process is not queued again.
+    """
+    global _master_build
+    with _master_build_lock:
+        if _master_build is None or _master_build.done():
+            _master_build = get_refresh_executor().submit(build_master)
+
+
+def build_master():
+    try:
+        with render_slot(blocking=True):
+            get_master_booklet().build()
+    except Exception:
+        logger.exception("Building the master booklet failed")
+    finally:
+        connection.close()
+
+
+def prerender_designs(design_ids):
+    """Render the fragments and warm the preview images of the approved designs among design_ids."""
+    designs = Design.objects.filter(id__in=design_ids, status="approved").select_related("material", "contributor")
+    for design in designs:
+        try:
+            prerender_design_fragment(design)
+        except Exception:
+            logger.exception("Pre-rendering design %s failed", design.pk)
+
+        preview_url = design.get_preview_url()
+        if preview_url:
+            try:
+                warm_url(preview_url)
+            except Exception as e:
+                logger.warning("Warming the preview of design %s failed: %s", design.pk, e)
@@ -0,0 +1,182 @@
+import os
+import re
+import tempfile
+import threading
+import time
+
+KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+# Seconds after which cull() lists the directory again even if this process's running
+# total is under max_size, to catch up with the entries other processes wrote
+RESCAN_INTERVAL = 60
+
+
+class DiskLRUCache:
+    """
+    A directory of files with a total size cap.
+
+    Reads refresh a file's atime, so when the cap is exceeded the files that
+    were least recently used are removed first. The mtime is left alone and
+    stays the time the entry was written. Writes go through a temporary
+    file and os.replace so other workers never see a partially written entry.
+    on_evict, if given, is called with the key of every entry removed by cull().
+
+    The total size is counted on disk once and then kept up to date with this
+    process's writes and deletes, so writes don't list the directory until it
+    may be over max_size (or RESCAN_INTERVAL has passed).
+    """
+
+    def __init__(self, directory, max_size, suffix="", on_evict=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        # Total size of the entries when last counted on disk, plus the changes made since
+        self._size = None
+        self._counted_at = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get_path(self, key):
+        """Return the path of a cached entry (marking it as recently used), or None."""
+        path = self.path(key)
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key):
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, data):
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            replaced = self._file_size(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._add_size(len(data) - replaced)
+        self.cull()
+        return path
+
+    def spool(self):
+        """
+        Return the path of a new empty temporary file in the cache directory, to be
+        written to and then stored with set_file() or removed by the caller.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        os.close(fd)
+        return tmp_path
+
+    def set_file(self, key, tmp_path):
+        """Store a file written to a spool() path under the given key without copying it."""
+        path = self.path(key)
+        added = self._file_size(tmp_path) - self._file_size(path)
+        os.replace(tmp_path, path)
+        self._add_size(added)
+        self.cull()
+        return path
+
+    def delete(self, key):
+        removed = self._remove(key)
+        if removed is None:
+            return False
+        self._add_size(-removed)
+        return True
+
+    def _remove(self, key):
+        """Remove an entry, returning its size, or None if there was none."""
+        path = self.path(key)
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        return size
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _add_size(self, change):
+        with self._lock:
+            if self._size is not None:
+                self._size += change
+
+    def keys(self):
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-") or not name.endswith(self.suffix):
+                continue
+            yield name[:len(name) - len(self.suffix)] if self.suffix else name
+
+    def delete_prefix(self, prefix):
+        deleted = 0
+        for key in list(self.keys()):
+            if key.startswith(prefix) and self.delete(key):
+                deleted += 1
+        return deleted
+
+    def _entries(self):
+        entries = []
+        for key in self.keys():
+            try:
+                stat = os.stat(self.path(key))
+            except (FileNotFoundError, ValueError):
+                continue
+            entries.append((stat.st_atime, stat.st_size, key))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def cull(self):
+        """
+        Remove least recently used entries until the cache fits in max_size.
+        Only lists the directory when the running total is over max_size, or
+        was last counted on disk more than RESCAN_INTERVAL seconds ago.
+        """
+        with self._lock:
+            if (
+                self._size is not None
+                and self._size <= self.max_size
+                and time.monotonic() - self._counted_at < RESCAN_INTERVAL
+            ):
+                return
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            evicted = []
+            for _, size, key in entries:
+                if total <= self.max_size:
+                    break
+                if self._remove(key) is not None:
+                    evicted.append(key)
+                total -= size
+            self._size = total
+            self._counted_at = time.monotonic()
+        if self.on_evict:
+            for key in evicted:
+                self.on_evict(key)
+
+    def clear(self):
+        for key in list(self.keys()):
+            self.delete(key)
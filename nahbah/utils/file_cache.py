@@ -0,0 +1,145 @@
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+import requests
+from django.conf import settings
+
+from nahbah.utils.disk_cache import DiskLRUCache
+from nahbah.utils.remote_files import CircuitOpenError, download
+
+_design_file_cache = None
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+# Revalidation answers meaning the file was deleted from Cloudinary
+GONE_STATUSES = {404, 410}
+
+
+class DesignFileCache:
+    """
+    Raw design file bytes from Cloudinary on local disk, keyed by public_id and version.
+
+    Versioned Cloudinary URLs never change, so those entries are served
+    without any network access. Unversioned entries are fresh for the
+    response's Cache-Control max-age and then revalidated with
+    If-None-Match/If-Modified-Since, or served stale if Cloudinary can't be
+    reached or answers with a 5xx. Entries answered with 404 or 410 are
+    dropped. Each entry is one file: a length-prefixed JSON header followed
+    by the body.
+    """
+
+    def __init__(self, location, max_size):
+        self.store = DiskLRUCache(location, max_size, suffix=".bin")
+        self.counters = {"hits": 0, "revalidated": 0, "stale": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(design_file):
+        parts = [
+            getattr(design_file, "resource_type", None),
+            getattr(design_file, "type", None),
+            getattr(design_file, "public_id", None) or str(design_file),
+            getattr(design_file, "version", None),
+            getattr(design_file, "format", None),
+        ]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _read(self, key):
+        data = self.store.get(key)
+        if data is None or len(data) < 4:
+            return None
+        (header_length,) = struct.unpack(">I", data[:4])
+        try:
+            meta = json.loads(data[4:4 + header_length])
+        except ValueError:
+            return None
+        return meta, data[4 + header_length:]
+
+    def _write(self, key, meta, body):
+        header = json.dumps(meta).encode("utf-8")
+        self.store.set(key, struct.pack(">I", len(header)) + header + body)
+
+    @staticmethod
+    def _expires(response, immutable):
+        if immutable:
+            return None
+        cache_control = response.headers.get("Cache-Control", "")
+        match = MAX_AGE_PATTERN.search(cache_control)
+        if "no-cache" in cache_control or "no-store" in cache_control or not match:
+            return time.time()
+        return time.time() + int(match.group(1))
+
+    def fetch(self, design_file, fetch=download):
+        """Return the bytes of a design file, downloading or revalidating it only when needed."""
+        key = self.key(design_file)
+        immutable = bool(getattr(design_file, "version", None))
+        url = design_file.url
+        cached = self._read(key)
+
+        if cached is not None:
+            meta, body = cached
+            if meta["expires"] is None or meta["expires"] > time.time():
+                self._count("hits")
+                return body
+
+            headers = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            try:
+                response = fetch(url, headers=headers)
+            except (CircuitOpenError, requests.RequestException) as e:
+                status_code = getattr(getattr(e, "response", None), "status_code", None)
+                if status_code in GONE_STATUSES:
+                    self.store.delete(key)
+                if status_code is not None and status_code < 500:
+                    raise
+                # Cloudinary can't be reached right now, the copy on disk is better than an error page
+                self._count("stale")
+                return body
+            if response.status_code == 304:
+                meta["expires"] = self._expires(response, immutable)
+                self._write(key, meta, body)
+                self._count("revalidated")
+                return body
+        else:
+            response = fetch(url)
+
+        body = response.content
+        meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires": self._expires(response, immutable),
+        }
+        self._write(key, meta, body)
+        self._count("misses")
+        return body
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        served_from_disk = counters["hits"] + counters["revalidated"] + counters["stale"]
+        return {
+            **counters,
+            "hit_rate": served_from_disk / lookups if lookups else None,
+            "entries": sum(1 for _ in self.store.keys()),
+            "size": self.store.size(),
+        }
+
+
+def get_design_file_cache():
+    global _design_file_cache
+    if _design_file_cache is None:
+        _design_file_cache = DesignFileCache(
+            settings.DESIGN_FILE_CACHE["LOCATION"],
+            settings.DESIGN_FILE_CACHE["MAX_SIZE"],
+        )
+    return _design_file_cache
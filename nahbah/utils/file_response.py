@@ -0,0 +1,118 @@
+import os
+import re
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    """
+    A read-only view of length bytes of an open file, starting at its current position.
+
+    fileno() is passed through so that servers with a sendfile-based
+    wsgi.file_wrapper (gunicorn) still send the range without copying it
+    through Python; they read from the current offset up to Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(file_stat):
+    return f'"{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) byte positions of a single-range Range header, None if
+    the header should be ignored (malformed or several ranges) or False if the
+    range is not satisfiable.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last n bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size:
+        return False
+    if end < start:
+        return None
+    return start, end
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """A Range request only applies if If-Range is absent or still matches the file."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/"')):
+        # Only strong validators can be used with If-Range
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def ranged_file_response(request, file, filename, content_type):
+    """
+    Serve an open file on disk as a download that can be resumed.
+
+    The full file is returned as a FileResponse, which servers stream with
+    sendfile. A single Range is answered with 206 Partial Content (or 416),
+    as long as If-Range still matches the file's ETag or Last-Modified date.
+    """
+    file_stat = os.fstat(file.fileno())
+    size = file_stat.st_size
+    etag = file_etag(file_stat)
+    last_modified = int(file_stat.st_mtime)
+
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header and request.method in ("GET", "HEAD") and if_range_matches(
+        request.META.get("HTTP_IF_RANGE"), etag, last_modified
+    ):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        file.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    elif byte_range:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(
+            FileRange(file, end - start + 1),
+            status=206,
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+    else:
+        response = FileResponse(file, as_attachment=True, filename=filename, content_type=content_type)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
@@ -0,0 +1,99 @@
+import hashlib
+import json
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from nahbah.utils.disk_cache import DiskLRUCache
+
+_fragment_cache = None
+
+
+class BaseFragmentCache:
+    """
+    Stores the rendered PDF fragment (metadata page plus design file pages)
+    of a single design, keyed by fragment_key().
+    """
+    enabled = True
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, data):
+        raise NotImplementedError
+
+    def delete_design(self, design_id):
+        """Drop every cached fragment of the given design."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class DummyFragmentCache(BaseFragmentCache):
+    """Disables fragment caching; designs are then rendered straight into the booklet."""
+    enabled = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, data):
+        pass
+
+    def delete_design(self, design_id):
+        pass
+
+    def clear(self):
+        pass
+
+
+class DiskFragmentCache(BaseFragmentCache):
+    """Keeps fragments as PDF files on local disk, evicting the least recently used."""
+
+    def __init__(self, location, max_size):
+        self.store = DiskLRUCache(location, max_size, suffix=".pdf")
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, data):
+        self.store.set(key, data)
+
+    def delete_design(self, design_id):
+        self.store.delete_prefix(f"{design_id}-")
+
+    def clear(self):
+        self.store.clear()
+
+
+def rendering_signature():
+    """Settings that change how booklet pages are rendered; part of every booklet cache key."""
+    return [settings.BASE_URL, settings.BOOKLET_QR_MODE, sorted(settings.BOOKLET_IMAGE_PROFILE.items())]
+
+
+def fragment_key(design):
+    """
+    Content-addressed cache key of a design's booklet fragment: the design id
+    plus a hash of everything that is rendered into it.
+    """
+    design_file = design.design_file
+    content = [
+        design.title,
+        design.description,
+        design.material.name,
+        design.contributor.name if design.contributor else None,
+        getattr(design_file, "public_id", None) if design_file else None,
+        getattr(design_file, "version", None) if design_file else None,
+        rendering_signature(),
+    ]
+    digest = hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()[:32]
+    return f"{design.id}-{digest}"
+
+
+def get_fragment_cache():
+    """Return the fragment cache backend configured in settings.BOOKLET_FRAGMENT_CACHE."""
+    global _fragment_cache
+    if _fragment_cache is None:
+        config = dict(settings.BOOKLET_FRAGMENT_CACHE)
+        backend = import_string(config.pop("BACKEND"))
+        _fragment_cache = backend(**{name.lower(): value for name, value in config.items()})
+    return _fragment_cache
@@ -1,44 +1,199 @@
 import os
 import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 import fitz  # PyMuPDF
-import qrcode
-import requests
 from io import BytesIO
 from PIL import Image
 from django.conf import settings
 from nahbah.models import Design
+from nahbah.utils.file_cache import get_design_file_cache
+from nahbah.utils.fragment_cache import fragment_key, get_fragment_cache
+from nahbah.utils.image_ingest import ingest_image
+from nahbah.utils.qr_codes import insert_qr_code
+from nahbah.utils.render_pool import DesignSnapshot, discard_render_pool, get_render_pool, render_fragment
 from reportlab.lib.units import mm
 from reportlab.lib.pagesizes import landscape
 
-BASE_URL = settings.BASE_URL  # Use settings instead of hardcoded
 INTRO_PDF_PATH = os.path.join(settings.STATIC_ROOT, "not_a_house_but_a_home_intro_pages.pdf")
 CREDITS_IMAGE_PATH = os.path.join(settings.STATIC_ROOT, "doodle.png")
 A6 = landscape((148 * mm, 105 * mm))
 
+# Options for Document.save(), selected with settings.BOOKLET_SAVE_PROFILE.
+# Designs from the fragment cache are merged from their own documents, each
+# with its own copy of the fonts, so every profile merges duplicate objects.
+SAVE_PROFILES = {
+    # Drop unused objects, merge duplicate objects and compress new content streams
+    "fast": {"garbage": 3, "deflate": True},
+    # Also merge duplicate streams (images repeated across design fragments),
+    # recompress images and fonts and pack objects into object streams
+    "smallest": {"garbage": 4, "deflate": True, "deflate_images": True, "deflate_fonts": True, "use_objstms": 1},
+}
 
-def generate_qr_code(url):
-    qr = qrcode.QRCode(box_size=2, border=2)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    stream = io.BytesIO()
-    img.save(stream, format="PNG")
-    stream.seek(0)
-    return stream
+# Intro and credits documents prepared once per process: name -> (signature, document)
+_static_pages = {}
+_static_pages_lock = threading.Lock()
+
+
+@contextmanager
+def timed(stats, stage):
+    """Add the wall time spent in the block to stats["timings"][stage], in seconds."""
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = stats.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+def fetch_design_file(design):
+    """Return the raw bytes of a design's file, through the local design file cache."""
+    return get_design_file_cache().fetch(design.design_file)
+
+
+def _fetch_or_error(design):
+    try:
+        return fetch_design_file(design)
+    except Exception as e:
+        return e
+
+
+def iter_design_files(designs, fragments=None, stats=None):
+    """
+    Download the files of the given designs concurrently and yield (design, file_content)
+    in their order. file_content is the file bytes, the exception raised while downloading
+    so the caller can render the error page, or None for designs without a file or with a
+    cached fragment in fragments. At most twice BOOKLET_FETCH_CONCURRENCY files are
+    downloading or waiting to be rendered at a time, so a booklet of many designs doesn't
+    hold all their files in memory. The time spent waiting for downloads is added to
+    stats["timings"]["fetch"].
+    """
+    window = max(1, settings.BOOKLET_FETCH_CONCURRENCY) * 2
+    executor = ThreadPoolExecutor(max_workers=max(1, settings.BOOKLET_FETCH_CONCURRENCY))
+    pending = deque()
+    downloading = 0
+
+    def next_file():
+        nonlocal downloading
+        design, future = pending.popleft()
+        if future is None:
+            return design, None
+        downloading -= 1
+        with timed(stats, "fetch"):
+            return design, future.result()
+
+    try:
+        for design in designs:
+            if design.design_file and (fragments is None or fragments.get(design.id) is None):
+                pending.append((design, executor.submit(_fetch_or_error, design)))
+                downloading += 1
+            else:
+                pending.append((design, None))
+            while pending and (pending[0][1] is None or downloading >= window):
+                yield next_file()
+        while pending:
+            yield next_file()
+    finally:
+        # If the caller stops early, cancel the downloads that have not started
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _static_document(name, signature, build):
+    """
+    Return the prepared document for name, building it again only if its
+    signature (source mtime, BASE_URL) changed. Caller must hold _static_pages_lock.
+    """
+    cached = _static_pages.get(name)
+    if cached is None or cached[0] != signature:
+        if cached is not None and cached[1] is not None:
+            cached[1].close()
+        cached = (signature, build())
+        _static_pages[name] = cached
+    return cached[1]
+
+
+def _build_intro_document():
+    if not os.path.exists(INTRO_PDF_PATH):
+        return None
+    with open(INTRO_PDF_PATH, "rb") as f:
+        return fitz.open(stream=f.read(), filetype="pdf")
+
+
+def _build_credits_document():
+    credits = fitz.open()
+    page = credits.new_page(width=A6[0], height=A6[1])
+    text = (
+        "Text by:\nDányi Tibor Zoltán (architect)\n\n"
+        "Drawings by:\nDányi Tibor Zoltán (architect)\nTamás Pethes (architect)\n\n"
+        "Edited by:\nDányi Tibor Zoltán (architect)\nNicolás Ramos González (architect)"
+    )
+
+    page.insert_text((30, 40), text, fontsize=10)
+
+    # Add doodle image
+    if os.path.exists(CREDITS_IMAGE_PATH):
+        doodle = fitz.Pixmap(CREDITS_IMAGE_PATH)
+        rect = fitz.Rect(160.76, 0.75, 260.76, 78.35)
+        page.insert_image(rect, pixmap=doodle, keep_proportion=True)
+
+    # QR Code to Home
+    insert_qr_code(page, fitz.Rect(350, 20, 420, 90), settings.BASE_URL)
+    return credits
+
+
+def _intro_document():
+    return _static_document("intro", _file_mtime(INTRO_PDF_PATH), _build_intro_document)
+
+
+def _credits_document():
+    signature = (_file_mtime(CREDITS_IMAGE_PATH), settings.BASE_URL)
+    return _static_document("credits", signature, _build_credits_document)
+
+
+def prepare_static_pages():
+    """Build the intro and credits pages ahead of the first booklet request."""
+    with _static_pages_lock:
+        _intro_document()
+        _credits_document()
 
 
 def add_intro_pages(pdf_writer):
-    if os.path.exists(INTRO_PDF_PATH):
-        intro_doc = fitz.open(INTRO_PDF_PATH)
-        for page in intro_doc:
-            pdf_writer.insert_pdf(intro_doc, from_page=page.number, to_page=page.number)
-        intro_doc.close()
+    with _static_pages_lock:
+        intro_doc = _intro_document()
+        if intro_doc is not None:
+            pdf_writer.insert_pdf(intro_doc)
 
 
-def add_design_entry(design, pdf_writer):
-    # Page 1: Metadata with wrapped text
-    meta_page = fitz.open()
-    page = meta_page.new_page(width=A6[0], height=A6[1])
+def add_design_entry(design, pdf_writer, file_content=None, stats=None):
+    """
+    Add the metadata page and the design file pages of a design.
+    Returns False if the design file could not be loaded and an error page was added instead.
+    """
+    with timed(stats, "metadata"):
+        add_metadata_page(design, pdf_writer)
+
+    with timed(stats, "convert"):
+        return add_design_file_pages(design, pdf_writer, file_content, stats=stats)
+
+
+def add_metadata_page(design, pdf_writer):
+    # Page 1: Metadata with wrapped text, drawn straight into the output so all pages share the font objects
+    design = DesignSnapshot.from_design(design)
+    page = pdf_writer.new_page(width=A6[0], height=A6[1])
     
     # Title
     title_rect = fitz.Rect(30, 30, A6[0] - 30, 60)
@@ -46,33 +201,31 @@ def add_design_entry(design, pdf_writer):
     
     # Material
     material_rect = fitz.Rect(30, 65, A6[0] - 30, 85)
-    page.insert_textbox(material_rect, f"Material: {design.material.name}", fontsize=10, fontname="helv")
+    page.insert_textbox(material_rect, f"Material: {design.material_name}", fontsize=10, fontname="helv")
     
     # Description
     desc_rect = fitz.Rect(30, 90, A6[0] - 100, A6[1] - 50)
     page.insert_textbox(desc_rect, design.description, fontsize=9, fontname="helv", align=fitz.TEXT_ALIGN_LEFT)
     
     # Contributor
-    contributor = design.contributor.name if design.contributor else "Anonymous"
+    contributor = design.contributor_name or "Anonymous"
     contrib_rect = fitz.Rect(30, A6[1] - 45, A6[0] - 100, A6[1] - 30)
     page.insert_textbox(contrib_rect, f"Contributor: {contributor}", fontsize=9, fontname="helv")
     
     # QR Code - Updated to point to frontend
-    frontend_design_url = f"{BASE_URL}/plans?design={design.id}"  # Adjust route as needed
-    qr_stream = generate_qr_code(frontend_design_url)
-    qr_img = fitz.Pixmap(qr_stream.read())
-    page.insert_image(fitz.Rect(A6[0] - 90, 20, A6[0] - 20, 90), pixmap=qr_img, keep_proportion=True)
-    
-    pdf_writer.insert_pdf(meta_page)
-    meta_page.close()
+    frontend_design_url = f"{settings.BASE_URL}/plans?design={design.id}"  # Adjust route as needed
+    insert_qr_code(page, fitz.Rect(A6[0] - 90, 20, A6[0] - 20, 90), frontend_design_url)
+
 
+def add_design_file_pages(design, pdf_writer, file_content=None, stats=None):
     # Pages 2+: Full Design File (PDF or Image from Cloudinary)
     if design.design_file:
         try:
-            file_url = design.design_file.url
-            response = requests.get(file_url)
-            response.raise_for_status()
-            file_stream = BytesIO(response.content)
+            if isinstance(file_content, Exception):
+                raise file_content
+            if file_content is None:
+                file_content = fetch_design_file(design)
+            file_stream = BytesIO(file_content)
             
             # Check if it's a PDF by trying to open it
             try:
@@ -81,61 +234,210 @@ def add_design_entry(design, pdf_writer):
                 design_doc.close()
             except:
                 # Not a PDF, treat as image
-                file_stream.seek(0)
-                img_doc = fitz.open()
-                img_page = img_doc.new_page(width=A6[0], height=A6[1])
-                img = fitz.Pixmap(file_stream)
+                img_page = pdf_writer.new_page(width=A6[0], height=A6[1])
                 rect = fitz.Rect(10, 10, A6[0] - 10, A6[1] - 10)
-                img_page.insert_image(rect, pixmap=img, keep_proportion=True)
-                pdf_writer.insert_pdf(img_doc)
-                img_doc.close()
+                image_data, image_info = ingest_image(file_content, rect)
+                img_page.insert_image(rect, stream=image_data, keep_proportion=True)
+                if stats is not None:
+                    stats["image_bytes_saved"] = stats.get("image_bytes_saved", 0) + image_info["bytes_saved"]
         except Exception as e:
             # Add error page if file loading fails
-            error_page = fitz.open()
-            err_pg = error_page.new_page(width=A6[0], height=A6[1])
-            err_pg.insert_textbox(fitz.Rect(30, 50, A6[0] - 30, A6[1] - 50), 
-                                 f"Error loading design file: {str(e)}", 
-                                 fontsize=10, fontname="helv")
-            pdf_writer.insert_pdf(error_page)
-            error_page.close()
+            err_pg = pdf_writer.new_page(width=A6[0], height=A6[1])
+            err_pg.insert_textbox(fitz.Rect(30, 50, A6[0] - 30, A6[1] - 50),
+                                  f"Error loading design file: {str(e)}",
+                                  fontsize=10, fontname="helv")
+            return False
+    return True
 
 
-def add_credits_page(pdf_writer):
-    credits = fitz.open()
-    page = credits.new_page(width=A6[0], height=A6[1])
-    text = (
-        "Text by:\nDányi Tibor Zoltán (architect)\n\n"
-        "Drawings by:\nDányi Tibor Zoltán (architect)\nTamás Pethes (architect)\n\n"
-        "Edited by:\nDányi Tibor Zoltán (architect)\nNicolás Ramos González (architect)"
-    )
+def add_cached_design_entry(design, pdf_writer, file_content=None, fragment=None, stats=None):
+    """
+    Add a design from its cached fragment, or render the fragment and cache it.
+    Fragments that ended up with an error page are not cached so the download is retried.
+    Returns False if an error page was added.
 
-    page.insert_text((30, 40), text, fontsize=10)
-    
-    # Add doodle image
-    if os.path.exists(CREDITS_IMAGE_PATH):
-        doodle = fitz.Pixmap(CREDITS_IMAGE_PATH)
-        rect = fitz.Rect(160.76, 0.75, 260.76, 78.35)
-        page.insert_image(rect, pixmap=doodle, keep_proportion=True)
+    A fragment is a document of its own because it is the cache entry; the
+    fonts it repeats are merged again when the booklet is saved (SAVE_PROFILES).
+    """
+    fragment_cache = get_fragment_cache()
+    if not fragment_cache.enabled:
+        return add_design_entry(design, pdf_writer, file_content, stats=stats)
+
+    if fragment is not None:
+        with timed(stats, "merge"):
+            fragment_doc = fitz.open(stream=fragment, filetype="pdf")
+            pdf_writer.insert_pdf(fragment_doc)
+            fragment_doc.close()
+        return True
+
+    fragment_doc, complete = render_design_fragment(design, file_content, stats=stats)
+    with timed(stats, "merge"):
+        pdf_writer.insert_pdf(fragment_doc)
+        fragment_doc.close()
+    return complete
+
+
+def add_rendered_fragment(design, pdf_writer, future, stats=None):
+    """
+    Merge a fragment rendered by the render pool (see submit_design_fragments())
+    and store it in the fragment cache. Returns False if it has an error page.
+    """
+    try:
+        with timed(stats, "render"):
+            fragment, complete, worker_stats = future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for using too much memory), render the design here
+        # instead, reading its file from the design file cache again
+        discard_render_pool()
+        return add_cached_design_entry(design, pdf_writer, stats=stats)
+    if stats is not None:
+        for stage, seconds in worker_stats.get("timings", {}).items():
+            stats["timings"][stage] = stats["timings"].get(stage, 0) + seconds
+        stats["image_bytes_saved"] = stats.get("image_bytes_saved", 0) + worker_stats.get("image_bytes_saved", 0)
+
+    fragment_cache = get_fragment_cache()
+    if complete and fragment_cache.enabled:
+        with timed(stats, "cache"):
+            fragment_cache.set(fragment_key(design), fragment)
+    with timed(stats, "merge"):
+        fragment_doc = fitz.open(stream=fragment, filetype="pdf")
+        pdf_writer.insert_pdf(fragment_doc)
+        fragment_doc.close()
+    return complete
+
+
+def submit_design_fragments(design_files, fragments):
+    """
+    Start rendering the designs of design_files (see iter_design_files()) without a
+    cached fragment in the render pool, one fragment per design, as their files arrive.
+    Yields (design, file_content, future) in order; future is None for designs with a
+    cached fragment, and for every design when the pool is disabled. The file content
+    is only passed on then: at most twice BOOKLET_RENDER_WORKERS designs wait in the
+    pool, so their files are not all pickled into its queue at once.
+    """
+    render_pool = get_render_pool()
+    if render_pool is None:
+        for design, file_content in design_files:
+            yield design, file_content, None
+        return
+
+    window = settings.BOOKLET_RENDER_WORKERS * 2
+    pending = deque()
+    rendering = 0
+    for design, file_content in design_files:
+        if fragments.get(design.id) is not None:
+            pending.append((design, None))
+        else:
+            if isinstance(file_content, Exception):
+                # Exceptions may not pickle, only their message ends up on the error page
+                file_content = Exception(str(file_content))
+            snapshot = DesignSnapshot.from_design(design)
+            try:
+                future = render_pool.submit(render_fragment, snapshot, file_content)
+            except BrokenProcessPool:
+                # A worker died since the last booklet, start a new pool
+                discard_render_pool()
+                render_pool = get_render_pool()
+                future = render_pool.submit(render_fragment, snapshot, file_content)
+            pending.append((design, future))
+            rendering += 1
+        while pending and (pending[0][1] is None or rendering >= window):
+            design, future = pending.popleft()
+            rendering -= future is not None
+            yield design, None, future
+    for design, future in pending:
+        yield design, None, future
 
-    # QR Code to Home
-    qr_stream = generate_qr_code(BASE_URL)
-    qr_img = fitz.Pixmap(qr_stream.read())
-    page.insert_image(fitz.Rect(350, 20, 420, 90), pixmap=qr_img, keep_proportion=True)
-    pdf_writer.insert_pdf(credits)
-    credits.close()
 
+def render_design_fragment(design, file_content=None, stats=None):
+    """
+    Render a design into a new fragment document and store it in the fragment cache.
+    Returns (fragment_doc, complete); incomplete fragments (with an error page) are not cached.
+    """
+    fragment_doc = fitz.open()
+    complete = add_design_entry(design, fragment_doc, file_content, stats=stats)
+    if complete:
+        with timed(stats, "cache"):
+            get_fragment_cache().set(fragment_key(design), fragment_doc.tobytes(garbage=3, deflate=True))
+    return fragment_doc, complete
 
-def generate_booklet(design_ids):
-    pdf_writer = fitz.open()
-    add_intro_pages(pdf_writer)
 
-    for design in Design.objects.filter(id__in=design_ids, status="approved"):
-        add_design_entry(design, pdf_writer)
+def prerender_design_fragment(design):
+    """Render and cache a design's fragment ahead of time unless it is already cached."""
+    fragment_cache = get_fragment_cache()
+    if not fragment_cache.enabled or fragment_cache.get(fragment_key(design)) is not None:
+        return False
+    fragment_doc, complete = render_design_fragment(design)
+    fragment_doc.close()
+    return complete
 
-    add_credits_page(pdf_writer)
 
+def add_credits_page(pdf_writer):
+    with _static_pages_lock:
+        pdf_writer.insert_pdf(_credits_document())
+
+
+def save_booklet(pdf_writer, output=None):
+    """
+    Save a finished booklet with the configured save profile. With an output path
+    the PDF is written straight to disk and the path returned, otherwise it is
+    returned as a BytesIO.
+    """
+    save_options = SAVE_PROFILES[settings.BOOKLET_SAVE_PROFILE]
+    if output is not None:
+        pdf_writer.save(output, **save_options)
+        return output
     output_stream = io.BytesIO()
-    pdf_writer.save(output_stream)
-    pdf_writer.close()
+    pdf_writer.save(output_stream, **save_options)
     output_stream.seek(0)
     return output_stream
+
+
+def generate_booklet(design_ids, stats=None, output=None):
+    """
+    Build the booklet PDF for the approved designs among design_ids.
+    The PDF is saved to the output path if one is given, see save_booklet().
+    With settings.BOOKLET_RENDER_WORKERS set, designs that are not in the fragment
+    cache are rendered in parallel in the render pool and merged in order.
+    If a stats dict is given, the ids of designs rendered with an error page
+    are stored in stats["failed_design_ids"], the seconds spent per stage
+    in stats["timings"] and the bytes saved by downscaling design images in
+    stats["image_bytes_saved"].
+    """
+    stats = stats if stats is not None else {}
+    stats["failed_design_ids"] = []
+    stats["timings"] = {}
+    stats["image_bytes_saved"] = 0
+
+    with timed(stats, "total"):
+        pdf_writer = fitz.open()
+        with timed(stats, "intro"):
+            add_intro_pages(pdf_writer)
+
+        with timed(stats, "query"):
+            designs = list(
+                Design.objects.filter(id__in=design_ids, status="approved")
+                .select_related("material", "contributor")
+                .order_by("id")
+            )
+            fragment_cache = get_fragment_cache()
+            fragments = {design.id: fragment_cache.get(fragment_key(design)) for design in designs}
+
+        design_files = iter_design_files(designs, fragments, stats=stats)
+        for design, file_content, future in submit_design_fragments(design_files, fragments):
+            if future is not None:
+                complete = add_rendered_fragment(design, pdf_writer, future, stats=stats)
+            else:
+                complete = add_cached_design_entry(
+                    design, pdf_writer, file_content, fragments[design.id], stats=stats
+                )
+            if not complete:
+                stats["failed_design_ids"].append(design.id)
+
+        with timed(stats, "credits"):
+            add_credits_page(pdf_writer)
+
+        with timed(stats, "save"):
+            result = save_booklet(pdf_writer, output)
+            pdf_writer.close()
+    return result
@@ -0,0 +1,60 @@
+import logging
+import math
+from io import BytesIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def target_size(rect, dpi):
+    """Pixel size needed to print an image filling rect (in points) at the given DPI."""
+    return math.ceil(rect.width / 72 * dpi), math.ceil(rect.height / 72 * dpi)
+
+
+def ingest_image(data, rect, profile=None):
+    """
+    Prepare design image bytes for embedding in rect on a booklet page.
+
+    JPEGs that already fit the print size are passed through untouched.
+    Larger images are downscaled to the profile's DPI and recompressed,
+    as JPEG unless the source is a PNG or has transparency.
+    Returns (image_bytes, info) where info["bytes_saved"] is the size difference.
+    """
+    profile = profile or settings.BOOKLET_IMAGE_PROFILE
+    max_size = target_size(rect, profile["DPI"])
+    info = {"original_bytes": len(data), "bytes": len(data), "bytes_saved": 0, "mode": "passthrough"}
+
+    try:
+        img = Image.open(BytesIO(data))
+    except (UnidentifiedImageError, OSError):
+        # Leave formats Pillow doesn't know to PyMuPDF
+        return data, info
+
+    with img:
+        oriented = img.getexif().get(0x0112, 1) == 1  # EXIF orientation
+        fits = img.width <= max_size[0] and img.height <= max_size[1]
+        if fits and oriented and img.format in ("JPEG", "PNG"):
+            return data, info
+
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        output_format = "PNG" if img.format == "PNG" or has_alpha else "JPEG"
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(max_size, Image.LANCZOS)
+
+        stream = BytesIO()
+        if output_format == "JPEG":
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.save(stream, format="JPEG", quality=profile["QUALITY"], optimize=True)
+        else:
+            img.save(stream, format="PNG", optimize=True)
+
+    result = stream.getvalue()
+    if len(result) >= len(data) and fits and oriented:
+        return data, info
+
+    info.update(bytes=len(result), bytes_saved=len(data) - len(result), mode="downscaled")
+    logger.debug("Downscaled design image to %sx%s, saved %s bytes", img.width, img.height, info["bytes_saved"])
+    return result, info
@@ -0,0 +1,268 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+import fitz  # PyMuPDF
+from django.conf import settings
+
+from nahbah.models import Design
+from nahbah.utils.fragment_cache import fragment_key, get_fragment_cache, rendering_signature
+from nahbah.utils.generate_booklet import (
+    CREDITS_IMAGE_PATH,
+    INTRO_PDF_PATH,
+    SAVE_PROFILES,
+    _file_mtime,
+    add_cached_design_entry,
+    add_credits_page,
+    add_intro_pages,
+    iter_design_files,
+    save_booklet,
+)
+
+_master_booklet = None
+
+# Seconds between retries of designs whose file could not be downloaded
+INCOMPLETE_RETRY_INTERVAL = 300
+# Bumped whenever the layout of master.json changes
+INDEX_VERSION = 2
+
+
+class MasterBookletNotReady(Exception):
+    """The master booklet has not been built yet, or is out of date and has to be built again."""
+
+
+class MasterBooklet:
+    """
+    The booklet of every approved design, kept on disk and updated in place.
+
+    Designs are ordered by id. An index next to the PDF records how many
+    pages each design occupies and the fragment_key() it was rendered from,
+    so a design can be spliced in or its page range removed without
+    rendering anything else. Writers take turns on one file lock while they
+    render, and only swap in the new PDF and index under a second lock,
+    which readers hold shared while they open both. Every worker process
+    can use it, and readers never wait for a render.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.pdf_path = os.path.join(location, "master.pdf")
+        self.index_path = os.path.join(location, "master.json")
+        self.lock_path = os.path.join(location, "master.lock")
+        self.write_lock_path = os.path.join(location, "master.write.lock")
+        self._retried_at = 0
+
+    @contextmanager
+    def _locked(self, exclusive=True, path=None):
+        os.makedirs(self.location, exist_ok=True)
+        with open(path or self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _writing(self):
+        """Held by the one writer at a time that may render and save."""
+        return self._locked(path=self.write_lock_path)
+
+    @staticmethod
+    def signature():
+        """Changes whenever the rendered booklet would look different, forcing a rebuild."""
+        content = [
+            INDEX_VERSION,
+            settings.BOOKLET_CATALOG_VERSION,
+            rendering_signature(),
+            _file_mtime(INTRO_PDF_PATH),
+            _file_mtime(CREDITS_IMAGE_PATH),
+        ]
+        return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.get("signature") != self.signature() or not os.path.exists(self.pdf_path):
+            return None
+        return index
+
+    def _save(self, doc, index):
+        index["page_count"] = len(doc)
+        tmp_pdf_path = self.pdf_path + ".tmp"
+        doc.save(tmp_pdf_path, **SAVE_PROFILES[settings.BOOKLET_SAVE_PROFILE])
+        tmp_index_path = self.index_path + ".tmp"
+        with open(tmp_index_path, "w") as f:
+            json.dump(index, f)
+        with self._locked():
+            os.replace(tmp_pdf_path, self.pdf_path)
+            os.replace(tmp_index_path, self.index_path)
+
+    @staticmethod
+    def _start_page(index, position):
+        return index["prefix_pages"] + sum(entry["pages"] for entry in index["entries"][:position])
+
+    @staticmethod
+    def _approved_designs(design_ids=None):
+        designs = Design.objects.filter(status="approved").select_related("material", "contributor").order_by("id")
+        if design_ids is not None:
+            designs = designs.filter(id__in=design_ids)
+        return list(designs)
+
+    @staticmethod
+    def _add_designs(doc, index, designs):
+        """Insert designs (sorted by id) at their position in the master booklet."""
+        fragment_cache = get_fragment_cache()
+        fragments = {design.id: fragment_cache.get(fragment_key(design)) for design in designs}
+        for design, file_content in iter_design_files(designs, fragments):
+            position = next(
+                (i for i, entry in enumerate(index["entries"]) if entry["id"] > design.id),
+                len(index["entries"]),
+            )
+            fragment_doc = fitz.open()
+            complete = add_cached_design_entry(design, fragment_doc, file_content, fragments[design.id])
+            doc.insert_pdf(fragment_doc, start_at=MasterBooklet._start_page(index, position))
+            index["entries"].insert(position, {
+                "id": design.id,
+                "key": fragment_key(design),
+                "pages": len(fragment_doc),
+                "complete": complete,
+            })
+            fragment_doc.close()
+
+    def _rebuild(self):
+        doc = fitz.open()
+        add_intro_pages(doc)
+        index = {"signature": self.signature(), "prefix_pages": len(doc), "entries": []}
+        self._add_designs(doc, index, self._approved_designs())
+        pages_before_credits = len(doc)
+        add_credits_page(doc)
+        index["suffix_pages"] = len(doc) - pages_before_credits
+        self._save(doc, index)
+        doc.close()
+        return index
+
+    def rebuild(self):
+        with self._writing():
+            return self._rebuild()
+
+    def build(self):
+        """Build the master booklet unless another worker already has."""
+        with self._writing():
+            if self._load_index() is None:
+                self._rebuild()
+
+    def sync(self, design_ids):
+        """
+        Bring the given designs up to date: remove the page ranges of designs that
+        changed, were rejected or deleted, and splice in the approved ones again.
+        Does nothing until the master booklet has been built once.
+        """
+        with self._writing():
+            index = self._load_index()
+            if index is None:
+                return
+
+            design_ids = set(design_ids)
+            approved = self._approved_designs(design_ids)
+            if not approved and not any(entry["id"] in design_ids for entry in index["entries"]):
+                return
+
+            doc = fitz.open(self.pdf_path)
+            for position in reversed(range(len(index["entries"]))):
+                entry = index["entries"][position]
+                if entry["id"] in design_ids:
+                    start = self._start_page(index, position)
+                    doc.delete_pages(from_page=start, to_page=start + entry["pages"] - 1)
+                    del index["entries"][position]
+            self._add_designs(doc, index, approved)
+            self._save(doc, index)
+            doc.close()
+
+    def _open_with_index(self):
+        """Open the stored PDF together with the index describing it."""
+        with self._locked(exclusive=False):
+            index = self._load_index()
+            if index is None:
+                raise MasterBookletNotReady("The booklet of all designs is being generated.")
+            return open(self.pdf_path, "rb"), index
+
+    def open(self):
+        """
+        Open the stored master booklet for reading, or raise MasterBookletNotReady
+        if it has to be built first (see booklet_jobs.schedule_master_build()).
+        Returns (file, incomplete_design_ids) where the latter lists designs that
+        were added with an error page and are due to be synced again.
+        """
+        master_file, index = self._open_with_index()
+        incomplete_ids = self._incomplete(index)
+        if not incomplete_ids or time.monotonic() - self._retried_at < INCOMPLETE_RETRY_INTERVAL:
+            return master_file, []
+        self._retried_at = time.monotonic()
+        return master_file, incomplete_ids
+
+    @staticmethod
+    def _incomplete(index):
+        return [entry["id"] for entry in index["entries"] if not entry["complete"]]
+
+    def _open_document(self):
+        """Like _open_with_index(), but opens the PDF with PyMuPDF, which reads pages from the file as needed."""
+        with self._locked(exclusive=False):
+            index = self._load_index()
+            if index is None:
+                raise MasterBookletNotReady("The booklet of all designs is being generated.")
+            return fitz.open(self.pdf_path), index
+
+    def extract(self, design_ids, stats=None, output=None):
+        """
+        Assemble a booklet of some approved designs by copying their page ranges out of the master.
+        Designs that the master does not have yet, or has in an older version (a sync is pending),
+        are rendered instead. Like generate_booklet(), stores the designs that have an error page
+        in stats["failed_design_ids"], along with the ones rendered here so the booklet is not
+        cached before the master has caught up, and saves to the output path if one is given.
+        Raises MasterBookletNotReady like open().
+        """
+        stats = stats if stats is not None else {}
+        stats["failed_design_ids"] = []
+        designs = self._approved_designs(design_ids)
+        master, index = self._open_document()
+        positions = {entry["id"]: position for position, entry in enumerate(index["entries"])}
+
+        outdated = [
+            design for design in designs
+            if design.id not in positions or index["entries"][positions[design.id]].get("key") != fragment_key(design)
+        ]
+        fragment_cache = get_fragment_cache()
+        fragments = {design.id: fragment_cache.get(fragment_key(design)) for design in outdated}
+        design_files = iter_design_files(outdated, fragments)
+
+        booklet = fitz.open()
+        if index["prefix_pages"]:
+            booklet.insert_pdf(master, from_page=0, to_page=index["prefix_pages"] - 1)
+        for design in designs:
+            if design.id in fragments:
+                # outdated is in the same order as designs
+                _, file_content = next(design_files)
+                add_cached_design_entry(design, booklet, file_content, fragments[design.id])
+                stats["failed_design_ids"].append(design.id)
+                continue
+            position = positions[design.id]
+            entry = index["entries"][position]
+            if not entry["complete"]:
+                stats["failed_design_ids"].append(design.id)
+            start = self._start_page(index, position)
+            booklet.insert_pdf(master, from_page=start, to_page=start + entry["pages"] - 1)
+        if index["suffix_pages"]:
+            booklet.insert_pdf(master, from_page=len(master) - index["suffix_pages"], to_page=len(master) - 1)
+        master.close()
+
+        result = save_booklet(booklet, output)
+        booklet.close()
+        return result
+
+
+def get_master_booklet():
+    global _master_booklet
+    if _master_booklet is None:
+        _master_booklet = MasterBooklet(settings.MASTER_BOOKLET_DIR)
+    return _master_booklet
@@ -0,0 +1,62 @@
+import io
+from functools import lru_cache
+import fitz  # PyMuPDF
+import qrcode
+from django.conf import settings
+
+
+@lru_cache(maxsize=settings.BOOKLET_QR_CACHE_SIZE)
+def qr_matrix(url):
+    """Return the QR modules of url (including the quiet zone) as rows of booleans."""
+    qr = qrcode.QRCode(box_size=2, border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+@lru_cache(maxsize=settings.BOOKLET_QR_CACHE_SIZE)
+def qr_png(url):
+    """Return the QR code of url as PNG bytes."""
+    qr = qrcode.QRCode(box_size=2, border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    stream = io.BytesIO()
+    img.save(stream, format="PNG")
+    return stream.getvalue()
+
+
+def draw_qr_code(page, rect, url):
+    """
+    Draw the QR code of url as filled vector rectangles, centered in rect
+    and kept square. Runs of dark modules on a row are merged into one rectangle.
+    """
+    matrix = qr_matrix(url)
+    count = len(matrix)
+    size = min(rect.width, rect.height)
+    module = size / count
+    x0 = rect.x0 + (rect.width - size) / 2
+    y0 = rect.y0 + (rect.height - size) / 2
+
+    shape = page.new_shape()
+    for row_index, row in enumerate(matrix):
+        top = y0 + row_index * module
+        column = 0
+        while column < count:
+            if not row[column]:
+                column += 1
+                continue
+            start = column
+            while column < count and row[column]:
+                column += 1
+            shape.draw_rect(fitz.Rect(x0 + start * module, top, x0 + column * module, top + module))
+    shape.finish(color=None, fill=(0, 0, 0), width=0)
+    shape.commit()
+
+
+def insert_qr_code(page, rect, url):
+    """Add the QR code of url to page, as vector shapes or as an image depending on BOOKLET_QR_MODE."""
+    if settings.BOOKLET_QR_MODE == "vector":
+        draw_qr_code(page, rect, url)
+    else:
+        page.insert_image(rect, stream=qr_png(url), keep_proportion=True)
@@ -0,0 +1,266 @@
+import random
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+# Responses that mean the remote host is struggling, worth another attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Upper bounds in seconds of the fetch latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CHUNK_SIZE = 64 * 1024
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+FetchedFile = namedtuple("FetchedFile", ["status_code", "headers", "content"])
+
+
+class FetchError(Exception):
+    """A remote file was not fetched; the message is shown on the booklet error page."""
+
+
+class ResponseTooLarge(FetchError):
+    pass
+
+
+class CircuitOpenError(FetchError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host after failure_threshold consecutive failures
+    (connection errors, timeouts and 5xx/429 responses).
+
+    While open, requests fail straight away with CircuitOpenError. After
+    reset_timeout seconds a single trial request is let through: if it
+    succeeds the breaker closes, otherwise it opens again. clock returns
+    the current time in seconds.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                remaining = self.reset_timeout - (self.clock() - self.opened_at)
+                if remaining <= 0:
+                    self.state = "half_open"
+                    return
+            else:
+                remaining = 0  # A trial request is running
+            self.rejected += 1
+        raise CircuitOpenError(
+            f"{self.name} is not responding, not trying again for {max(remaining, 0):.0f} seconds."
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = self.clock()
+                self.times_opened += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "seconds_since_last_opened": self.clock() - self.opened_at if self.opened_at else None,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyHistogram:
+    """Counts of observed durations per bucket, keyed by the bucket's upper bound in seconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self._lock:
+            self.counts[index] += 1
+            self.total += seconds
+
+    def stats(self):
+        with self._lock:
+            counts, total = list(self.counts), self.total
+        labels = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, counts)),
+            "count": sum(counts),
+            "sum": total,
+        }
+
+
+_latency = {"success": LatencyHistogram(), "failure": LatencyHistogram()}
+_retries = {"count": 0}
+_retries_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the process-wide keep-alive session used to download design files."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=settings.BOOKLET_FETCH_CONCURRENCY)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
+
+
+def get_circuit_breaker(url):
+    """Return the circuit breaker of the host a URL points to."""
+    host = urlsplit(url).netloc
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(
+                host,
+                settings.BOOKLET_FETCH_BREAKER["FAILURE_THRESHOLD"],
+                settings.BOOKLET_FETCH_BREAKER["RESET_TIMEOUT"],
+            )
+        return _circuit_breakers[host]
+
+
+def _timeouts():
+    return settings.BOOKLET_FETCH_CONNECT_TIMEOUT, settings.BOOKLET_FETCH_TIMEOUT
+
+
+def _read_body(response, max_size):
+    """Read a streamed response body, enforcing max_size and BOOKLET_FETCH_TIMEOUT for the whole body."""
+    content_length = response.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > max_size:
+        raise ResponseTooLarge(f"The file is larger than {max_size} bytes.")
+
+    deadline = time.monotonic() + settings.BOOKLET_FETCH_TIMEOUT
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise ResponseTooLarge(f"The file is larger than {max_size} bytes.")
+        if time.monotonic() > deadline:
+            raise requests.Timeout(f"Reading the file took longer than {settings.BOOKLET_FETCH_TIMEOUT} seconds.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _attempt(url, headers):
+    with get_http_session().get(url, headers=headers, timeout=_timeouts(), stream=True) as response:
+        if response.status_code != 304:
+            response.raise_for_status()
+        content = _read_body(response, settings.BOOKLET_FETCH_MAX_SIZE)
+        return FetchedFile(response.status_code, response.headers, content)
+
+
+def _is_host_failure(error):
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def _backoff(attempt):
+    # Exponential backoff with full jitter, so retries from parallel fetches spread out
+    return random.uniform(0, settings.BOOKLET_FETCH_RETRY_BACKOFF * 2 ** attempt)
+
+
+def download(url, headers=None):
+    """
+    GET a remote file. Returns a FetchedFile, which is either successful or
+    304 Not Modified when conditional headers were sent; raises otherwise.
+
+    Connection errors, timeouts and 5xx/429 responses are retried up to
+    BOOKLET_FETCH_RETRIES times and count towards the host's circuit breaker;
+    while it is open, CircuitOpenError is raised without sending a request.
+    Bodies larger than BOOKLET_FETCH_MAX_SIZE raise ResponseTooLarge.
+    """
+    breaker = get_circuit_breaker(url)
+    for attempt in range(settings.BOOKLET_FETCH_RETRIES + 1):
+        breaker.before_request()
+        start = time.monotonic()
+        try:
+            result = _attempt(url, headers)
+        except Exception as e:
+            _latency["failure"].observe(time.monotonic() - start)
+            if not _is_host_failure(e):
+                # The host answered (404, oversized file): no use retrying
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt == settings.BOOKLET_FETCH_RETRIES:
+                raise
+            with _retries_lock:
+                _retries["count"] += 1
+            time.sleep(_backoff(attempt))
+            continue
+        _latency["success"].observe(time.monotonic() - start)
+        breaker.record_success()
+        return result
+
+
+def warm_url(url):
+    """
+    Request a URL and discard the body, so Cloudinary generates and caches a
+    derived asset (such as a preview transformation) before a visitor asks for it.
+    Skipped with CircuitOpenError while the host's circuit breaker is open.
+    """
+    breaker = get_circuit_breaker(url)
+    breaker.before_request()
+    try:
+        with get_http_session().get(url, stream=True, timeout=_timeouts()) as response:
+            response.raise_for_status()
+    except Exception as e:
+        if _is_host_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+
+
+def fetch_stats():
+    """Circuit breaker states, retry count and download latency histograms of this process."""
+    with _circuit_breakers_lock:
+        breakers = list(_circuit_breakers.values())
+    with _retries_lock:
+        retries = _retries["count"]
+    return {
+        "circuit_breakers": {breaker.name: breaker.stats() for breaker in breakers},
+        "retries": retries,
+        "latency": {outcome: histogram.stats() for outcome, histogram in _latency.items()},
+    }
@@ -0,0 +1,98 @@
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+# Seconds between attempts to take a busy lock
+POLL_INTERVAL = 0.1
+# Number of lock files identical requests are spread over; unrelated selections
+# only wait for each other when their keys land on the same file
+FLIGHT_STRIPES = 1024
+
+_counters = {"rendered": 0, "coalesced": 0, "rejected": 0}
+_counters_lock = threading.Lock()
+
+
+class BookletBusy(Exception):
+    """No booklet can be rendered right now; the client should retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def count_render(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+def _lock_file(name):
+    os.makedirs(settings.BOOKLET_LOCK_DIR, exist_ok=True)
+    return open(os.path.join(settings.BOOKLET_LOCK_DIR, name), "a")
+
+
+def _try_lock(lock_file):
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+@contextmanager
+def single_flight(key):
+    """
+    Let one request at a time, across threads and worker processes, build the
+    booklet for a cache key. Identical requests wait up to
+    BOOKLET_SINGLE_FLIGHT_TIMEOUT seconds for it to finish (and should then find
+    it in the booklet cache) before BookletBusy is raised.
+    """
+    stripe = int(key[:8], 16) % FLIGHT_STRIPES
+    with _lock_file(f"flight-{stripe}.lock") as lock_file:
+        deadline = time.monotonic() + settings.BOOKLET_SINGLE_FLIGHT_TIMEOUT
+        while not _try_lock(lock_file):
+            if time.monotonic() >= deadline:
+                count_render("rejected")
+                raise BookletBusy("This booklet is still being generated.", settings.BOOKLET_RETRY_AFTER)
+            time.sleep(POLL_INTERVAL)
+        yield  # The lock is released when the file is closed
+
+
+@contextmanager
+def render_slot(blocking=False):
+    """
+    Hold one of the BOOKLET_MAX_CONCURRENT_RENDERS render slots shared by all
+    worker processes on this machine (0 means no limit). Raises BookletBusy if
+    all slots are taken, or with blocking=True waits for one to free up.
+    Slots are flock()ed files, so they are released even if a process dies.
+    """
+    if settings.BOOKLET_MAX_CONCURRENT_RENDERS < 1:
+        count_render("rendered")
+        yield
+        return
+
+    slot_file = None
+    while slot_file is None:
+        for slot in range(settings.BOOKLET_MAX_CONCURRENT_RENDERS):
+            lock_file = _lock_file(f"render-{slot}.lock")
+            if _try_lock(lock_file):
+                slot_file = lock_file
+                break
+            lock_file.close()
+        else:
+            if not blocking:
+                count_render("rejected")
+                raise BookletBusy("Too many booklets are being generated right now.", settings.BOOKLET_RETRY_AFTER)
+            time.sleep(POLL_INTERVAL)
+
+    with slot_file:
+        count_render("rendered")
+        yield
+
+
+def render_limit_stats():
+    """Renders, requests served by waiting for an identical render, and requests turned away, in this process."""
+    with _counters_lock:
+        return dict(_counters)
@@ -0,0 +1,107 @@
+import json
+import multiprocessing
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+from django.conf import settings
+
+# Settings used while drawing design pages, copied into the worker processes
+RENDER_SETTINGS = ("BASE_URL", "STATIC_ROOT", "BOOKLET_QR_MODE", "BOOKLET_QR_CACHE_SIZE", "BOOKLET_IMAGE_PROFILE")
+
+_render_pool = None
+_render_pool_key = None
+_render_pool_lock = threading.Lock()
+
+
+class DesignSnapshot(namedtuple(
+    "DesignSnapshot", ["id", "title", "description", "material_name", "contributor_name", "design_file"]
+)):
+    """
+    The fields of a design that go into its booklet pages. Unlike a Design
+    instance it can be sent to a render worker process without a database.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_design(cls, design):
+        if isinstance(design, cls):
+            return design
+        return cls(
+            id=design.id,
+            title=design.title,
+            description=design.description,
+            material_name=design.material.name,
+            contributor_name=design.contributor.name if design.contributor else None,
+            design_file=design.design_file,
+        )
+
+
+def render_settings():
+    return {name: getattr(settings, name) for name in RENDER_SETTINGS}
+
+
+def _init_worker(overrides):
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def render_fragment(snapshot, file_content):
+    """
+    Render a design into a standalone fragment PDF in a worker process.
+    Returns (fragment_bytes, complete, stats) where stats holds the worker's
+    stage timings and image_bytes_saved.
+    """
+    from nahbah.utils.generate_booklet import add_design_entry
+
+    stats = {}
+    fragment_doc = fitz.open()
+    complete = add_design_entry(snapshot, fragment_doc, file_content, stats=stats)
+    data = fragment_doc.tobytes(garbage=3, deflate=True)
+    fragment_doc.close()
+    return data, complete, stats
+
+
+def get_render_pool():
+    """
+    Return the process pool for rendering design fragments, or None when
+    settings.BOOKLET_RENDER_WORKERS is 0 and designs are rendered in-process.
+
+    Workers are started from a forkserver rather than forked from this
+    (multi-threaded) process, and the pool is replaced if the worker count or
+    the rendering settings change.
+    """
+    global _render_pool, _render_pool_key
+    workers = settings.BOOKLET_RENDER_WORKERS
+    if workers < 1:
+        return None
+
+    overrides = render_settings()
+    key = (workers, json.dumps(overrides, sort_keys=True, default=str))
+    with _render_pool_lock:
+        if _render_pool_key != key:
+            if _render_pool is not None:
+                _render_pool.shutdown(wait=False)
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_worker,
+                initargs=(overrides,),
+            )
+            _render_pool_key = key
+        return _render_pool
+
+
+def discard_render_pool():
+    """Drop the pool after a worker died (it is broken then) so that get_render_pool() starts a new one."""
+    global _render_pool, _render_pool_key
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False)
+        _render_pool, _render_pool_key = None, None
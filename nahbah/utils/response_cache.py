@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_response_cache = None
+
+
+class ResponseCache:
+    """
+    Serialized API responses in a Django cache (settings.RESPONSE_CACHE_ALIAS).
+
+    Every response depends on a few namespaces, e.g. "materials" or
+    "design:42". Each namespace has a generation token stored in the same
+    cache, and the response key includes the tokens, so invalidate() only
+    replaces tokens and the old entries are never read again (they expire or
+    get culled). Tokens are replaced rather than incremented, so concurrent
+    invalidations cannot be lost, and a token that was culled gets a fresh
+    value instead of going back to an old one.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # Django cache instances are per thread
+        return caches[self.alias]
+
+    @staticmethod
+    def generation_key(namespace):
+        return f"generation:{namespace}"
+
+    def generations(self, namespaces):
+        keys = [self.generation_key(namespace) for namespace in namespaces]
+        tokens = self.cache.get_many(keys)
+        for key in keys:
+            if key not in tokens:
+                self.cache.add(key, uuid.uuid4().hex, None)
+                tokens[key] = self.cache.get(key) or uuid.uuid4().hex
+        return [tokens[key] for key in keys]
+
+    def key(self, request, namespaces):
+        """
+        Key of a response: its absolute URL (links in paginated responses include the host),
+        whether the caller is signed in and the generations of its namespaces.
+        """
+        variant = "|".join([
+            request.build_absolute_uri(),
+            "authenticated" if request.user.is_authenticated else "anonymous",
+            *self.generations(namespaces),
+        ])
+        return "response:" + hashlib.sha256(variant.encode("utf-8")).hexdigest()
+
+    def get(self, endpoint, key):
+        data = self.cache.get(key)
+        with self._lock:
+            self.counters[endpoint]["misses" if data is None else "hits"] += 1
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data)
+
+    def invalidate(self, *namespaces):
+        """
+        Replace the generation tokens of namespaces once the current transaction commits,
+        so a request can't cache the old data under the new token in between.
+        """
+        def replace_tokens():
+            self.cache.set_many({self.generation_key(namespace): uuid.uuid4().hex for namespace in namespaces}, None)
+            with self._lock:
+                self.invalidations += 1
+
+        transaction.on_commit(replace_tokens)
+
+    def stats(self):
+        with self._lock:
+            endpoints = {endpoint: dict(counters) for endpoint, counters in self.counters.items()}
+            invalidations = self.invalidations
+        for counters in endpoints.values():
+            counters["hit_rate"] = counters["hits"] / (counters["hits"] + counters["misses"])
+        return {"endpoints": endpoints, "invalidations": invalidations}
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(settings.RESPONSE_CACHE_ALIAS)
+    return _response_cache
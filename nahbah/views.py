@@ -1,30 +1,451 @@
-from rest_framework import viewsets, status
+import hashlib
+import json
+import os
+from datetime import datetime, time
+from rest_framework import mixins, viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import Contributor, Design, Material
-from .serializers import ContributorSerializer, DesignSerializer, MaterialSerializer
-from django.http import FileResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from .models import BookletJob, CatalogVersion, Contributor, Design, Material, designs_updated
+from .pagination import DesignCursorPagination, DesignSearchPagination
+from .serializers import (
+    BookletJobSerializer, ContributorSerializer, DesignSerializer, MaterialSerializer, parse_contributor,
+    parse_list_param
+)
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from nahbah.utils.booklet_cache import get_booklet_cache
+from nahbah.utils.booklet_jobs import schedule_design_refresh, schedule_master_build, submit_booklet_job
+from nahbah.utils.file_cache import get_design_file_cache
+from nahbah.utils.file_response import ranged_file_response
 from nahbah.utils.generate_booklet import generate_booklet
+from nahbah.utils.master_booklet import MasterBookletNotReady, get_master_booklet
+from nahbah.utils.remote_files import fetch_stats
+from nahbah.utils.render_limits import BookletBusy, count_render, render_limit_stats, render_slot, single_flight
+from nahbah.utils.response_cache import get_response_cache
 from django.shortcuts import redirect
 from django.conf import settings
 
 
+def cached_booklet(approved_ids, build):
+    """
+    Return the booklet of the given approved designs from the booklet cache, or
+    build it with build(approved_ids, stats=..., output=path) and cache it if it has no error pages
+    and the catalog did not change during the build.
+    The booklet is always returned as an open file on disk.
+
+    Identical concurrent requests wait for a single build, and builds need a
+    render slot; BookletBusy is raised when the wait or the slots run out.
+    """
+    booklet_cache = get_booklet_cache()
+    booklet_file = open_cached_booklet(booklet_cache, approved_ids)
+    if booklet_file:
+        return booklet_file
+
+    with single_flight(booklet_cache.key(approved_ids)):
+        # Another request may have built it while this one was waiting
+        booklet_file = open_cached_booklet(booklet_cache, approved_ids)
+        if booklet_file:
+            count_render("coalesced")
+            return booklet_file
+
+        booklet_stats = {}
+        spool_path = booklet_cache.spool()
+        try:
+            with render_slot():
+                catalog_version = CatalogVersion.current().version
+                build(approved_ids, stats=booklet_stats, output=spool_path)
+            booklet_file = open(spool_path, "rb")
+            # Don't keep booklets with error pages around, the downloads may succeed next time,
+            # nor booklets of designs that changed while they were built (their invalidation has already run)
+            if not booklet_stats["failed_design_ids"] and CatalogVersion.current().version == catalog_version:
+                booklet_cache.set_file(approved_ids, spool_path)
+        finally:
+            # The open file stays readable after the spool file is removed
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+    return booklet_file
+
+
+def open_cached_booklet(booklet_cache, approved_ids):
+    cached_path = booklet_cache.get_path(approved_ids)
+    if cached_path:
+        try:
+            return open(cached_path, "rb")
+        except FileNotFoundError:
+            pass  # Evicted between lookup and open
+    return None
+
+
+def busy_response(error):
+    return Response(
+        {"error": str(error)},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def booklet_response(request, booklet_file):
+    return ranged_file_response(
+        request,
+        booklet_file,
+        filename="not_a_house_but_a_home.pdf",
+        content_type="application/pdf",
+    )
+
+
+def parse_id_param(name, value):
+    """Parse a query parameter given as comma-separated ids; any entry that is not an id is an error."""
+    ids = [id.strip() for id in value.split(",") if id.strip()]
+    if not ids or not all(id.isdigit() for id in ids):
+        raise ValidationError({"error": f"Invalid {name}, use comma-separated ids."})
+    return [int(id) for id in ids]
+
+
+def parse_datetime_param(name, value):
+    """Parse a query parameter given as an ISO date or datetime into an aware datetime."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({"error": f"Invalid {name}, use YYYY-MM-DD or an ISO 8601 datetime."})
+        parsed = datetime.combine(date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def catalog_etag(request, catalog_version):
+    """
+    Strong ETag of a catalog response: the catalog version plus everything else
+    the representation depends on (URL and query, media type, whether the
+    caller is signed in, which changes the default status filter).
+    """
+    variant = "|".join([
+        request.get_full_path(),
+        request.accepted_media_type or "",
+        "authenticated" if request.user.is_authenticated else "anonymous",
+    ])
+    digest = hashlib.sha256(variant.encode()).hexdigest()[:16]
+    return f'"{catalog_version.version}-{digest}"'
+
+
+def is_not_modified(request, etag, last_modified):
+    """If-None-Match takes precedence over If-Modified-Since, as in RFC 9110."""
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        # Weak comparison
+        etags = [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+        return "*" in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+class CatalogConditionalGetMixin:
+    """
+    Conditional GET for list and detail responses of catalog data. The ETag and
+    Last-Modified headers come from the CatalogVersion, which is read before the
+    queryset, so a request whose validators still match gets a 304 without
+    querying or serializing anything else.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        catalog_version = CatalogVersion.current()
+        etag = catalog_etag(request, catalog_version)
+        last_modified = int(catalog_version.updated_at.timestamp())
+
+        if is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class CachedResponseMixin:
+    """
+    Serve list and detail responses from the response cache. The view names
+    the invalidation namespaces a response depends on in
+    response_cache_namespaces(), or returns None to skip the cache; signals.py
+    invalidates the namespaces when designs or materials change.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def response_cache_namespaces(self):
+        return ["catalog"]
+
+    def cached_response(self, view, request, *args, **kwargs):
+        namespaces = self.response_cache_namespaces()
+        if namespaces is None:
+            return view(request, *args, **kwargs)
+
+        response_cache = get_response_cache()
+        key = response_cache.key(request, namespaces)
+        data = response_cache.get(f"{self.basename}-{self.action}", key)
+        if data is not None:
+            return Response(data)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, response.data)
+        return response
+
+
+def parse_design_ids(value):
+    """Parse design ids given as a comma-separated string or a list, skipping invalid entries."""
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(item) for item in value)
+    return [int(id.strip()) for id in str(value).split(",") if id.strip().isdigit()]
+
+
+def resolve_materials(names):
+    """Materials by name, creating the missing ones; a few queries whatever the number of names."""
+    materials = {material.name: material for material in Material.objects.filter(name__in=names)}
+    missing = set(names) - set(materials)
+    if missing:
+        # A concurrent submission may create the same material, ignore it and read both back
+        Material.objects.bulk_create([Material(name=name) for name in missing], ignore_conflicts=True)
+        materials.update((material.name, material) for material in Material.objects.filter(name__in=missing))
+        # bulk_create() skips Material.save() and its signals
+        get_response_cache().invalidate("materials")
+    return materials
+
+
+def resolve_contributors(contributors):
+    """
+    Contributors by email, like the get_or_create() of DesignSerializer.create():
+    the oldest contributor with the email, otherwise a new one named after the
+    first submission that gave it. contributors maps emails (or None) to names.
+    A blank email is an email like any other there, so it is looked up too.
+    """
+    resolved = {}
+    emails = [email for email in contributors if email is not None]
+    for contributor in Contributor.objects.filter(email__in=emails).order_by("id"):
+        resolved.setdefault(contributor.email, contributor)
+    if None in contributors:
+        resolved[None] = Contributor.objects.filter(email__isnull=True).order_by("id").first()
+    missing = [email for email in contributors if resolved.get(email) is None]
+    created = Contributor.objects.bulk_create([Contributor(email=email, name=contributors[email]) for email in missing])
+    resolved.update(zip(missing, created))
+    return resolved
+
+
+def create_design_batch(items, context):
+    """
+    Validate each submitted design with DesignSerializer, then create the valid
+    ones together: materials and contributors are resolved with set-based
+    queries and the designs inserted with bulk_create() in one transaction.
+    Returns a result per item, in order, with the new design's id or its errors.
+    """
+    materials = Material.objects.in_bulk(
+        [item.get("material_id") for item in items if str(item.get("material_id", "")).isdigit()]
+    )
+    results = []
+    submissions = []  # (result, design, custom material name, contributor details) of the valid items
+    for index, item in enumerate(items):
+        result = {"index": index, "status": "error"}
+        results.append(result)
+        serializer = DesignSerializer(data=item, context={**context, "materials": materials})
+        if not serializer.is_valid():
+            result["errors"] = serializer.errors
+            continue
+
+        data = dict(serializer.validated_data)
+        custom_material_name = data.pop("custom_material_name", None)
+        try:
+            contributor = parse_contributor(data.pop("contributor", None))
+            if contributor and not isinstance(contributor, dict):
+                raise ValueError(contributor)
+        except ValueError:
+            result["errors"] = {"contributor": ["Expected an object with name and email."]}
+            continue
+        design = Design(**data)
+        try:
+            # Upload the files and build the previews before the transaction
+            design.prepare_files()
+        except Exception as e:
+            result["errors"] = {"design_file": [str(e)]}
+            continue
+        submissions.append((result, design, custom_material_name, contributor or None))
+
+    if not submissions:
+        return results
+
+    with transaction.atomic():
+        custom_materials = resolve_materials({name for _, _, name, _ in submissions if name})
+        contributors = {}
+        for _, _, _, contributor in submissions:
+            if contributor:
+                contributors.setdefault(contributor.get("email"), contributor.get("name"))
+        contributors = resolve_contributors(contributors)
+
+        for _, design, custom_material_name, contributor in submissions:
+            if custom_material_name:
+                design.material = custom_materials[custom_material_name]
+            if contributor:
+                design.contributor = contributors[contributor.get("email")]
+        designs = Design.objects.bulk_create([design for _, design, _, _ in submissions])
+
+        # What save() and the post_save signals do for a single design
+        design_ids = [design.id for design in designs]
+        Design.objects.filter(id__in=design_ids).update_search_vectors()
+        designs_updated.send(
+            sender=Design, design_ids=design_ids, fields={field.name for field in Design._meta.concrete_fields}
+        )
+
+    for result, design, _, _ in submissions:
+        result.update(status="created", id=design.id)
+    return results
+
+
 class ContributorViewSet(viewsets.ModelViewSet):
     queryset = Contributor.objects.all()
     serializer_class = ContributorSerializer
 
 
 # Material ViewSet (List Materials)
-class MaterialViewSet(viewsets.ReadOnlyModelViewSet):
+class MaterialViewSet(CatalogConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Material.objects.all()
     serializer_class = MaterialSerializer
 
+    def response_cache_namespaces(self):
+        return ["catalog", "materials"]
+
 
 #  Design ViewSet (CRUD + Moderation)
-class DesignViewSet(viewsets.ModelViewSet):
-    queryset = Design.objects.all()
+class DesignViewSet(CatalogConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    # DesignSerializer nests the material
+    queryset = Design.objects.select_related("material")
     serializer_class = DesignSerializer
+    pagination_class = DesignCursorPagination
+
+    def get_queryset(self):
+        """
+        The design list and search can be filtered in the database with
+        ?status=approved,pending, ?material=<id>[,<id>], ?contributor=<id>[,<id>] and
+        ?submitted_after= / ?submitted_before= (ISO date or datetime; after is
+        inclusive, before exclusive). Anonymous callers only get approved
+        designs unless they ask for a status.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ("list", "search"):
+            return queryset
+
+        params = self.request.query_params
+        statuses = [value for value in params.get("status", "").split(",") if value]
+        if not statuses and not self.request.user.is_authenticated:
+            statuses = ["approved"]
+        if statuses:
+            valid_statuses = {choice for choice, _ in Design._meta.get_field("status").choices}
+            if not set(statuses) <= valid_statuses:
+                raise ValidationError({"error": "Invalid status"})
+            queryset = queryset.filter(status__in=statuses)
+
+        if "material" in params:
+            queryset = queryset.filter(material_id__in=parse_id_param("material", params["material"]))
+        if "contributor" in params:
+            queryset = queryset.filter(contributor_id__in=parse_id_param("contributor", params["contributor"]))
+        if params.get("submitted_after"):
+            queryset = queryset.filter(
+                submission_date__gte=parse_datetime_param("submitted_after", params["submitted_after"])
+            )
+        if params.get("submitted_before"):
+            queryset = queryset.filter(
+                submission_date__lt=parse_datetime_param("submitted_before", params["submitted_before"])
+            )
+        return queryset
+
+    def response_cache_namespaces(self):
+        """
+        Cache the design detail and the pages of the approved design list,
+        the one visitors browse; moderators' lists change too often.
+        """
+        if self.action == "retrieve" and str(self.kwargs.get("pk", "")).isdigit():
+            return ["catalog", "materials", f"design:{self.kwargs['pk']}"]
+        if self.action == "list":
+            status_param = self.request.query_params.get("status")
+            if status_param == "approved" or (status_param is None and not self.request.user.is_authenticated):
+                return ["catalog", "materials", "designs"]
+        return None
+
+    def get_paginated_response(self, data):
+        """With ?include=materials, add the materials of the page's designs once, keyed by id."""
+        response = super().get_paginated_response(data)
+        if "materials" in parse_list_param(self.request.query_params.get("include", "")):
+            materials = {design.material_id: design.material for design in self.paginator.page}
+            serializer = MaterialSerializer(list(materials.values()), many=True, context=self.get_serializer_context())
+            response.data["materials"] = {material["id"]: material for material in serializer.data}
+        return response
+
+    @action(detail=False, methods=["get"], pagination_class=DesignSearchPagination)
+    def search(self, request):
+        """
+        Full text search over title, description and material name, best matches first.
+        Takes the same filters and field selection parameters as the list.
+        Example: /api/designs/search/?q=bamboo roof -plastic&page=2
+        """
+        terms = request.query_params.get("q", "").strip()
+        if not terms:
+            return Response({"error": "No search terms provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        page = self.paginate_queryset(self.get_queryset().search(terms))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """
+        Submit many designs at once, e.g. from a workshop. Takes "designs", a list
+        of the fields accepted by create (as JSON, or as a JSON string in a
+        multipart request with each design's file under design_file_<index>).
+        Valid designs are created even if others fail; the response has a result
+        per design with its id or its errors, and is 207 when some failed.
+        """
+        items = request.data.get("designs")
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except ValueError:
+                items = None
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return Response({"error": "designs must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.DESIGN_BATCH_MAX_SIZE:
+            return Response(
+                {"error": f"At most {settings.DESIGN_BATCH_MAX_SIZE} designs can be submitted at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        for index, item in enumerate(items):
+            if f"design_file_{index}" in request.FILES:
+                item["design_file"] = request.FILES[f"design_file_{index}"]
+
+        results = create_design_batch(items, self.get_serializer_context())
+        created = sum(1 for result in results if result["status"] == "created")
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results}, status=response_status
+        )
 
     @action(detail=True, methods=["PATCH"])
     def moderate(self, request, pk=None):
@@ -82,30 +503,121 @@ class DesignViewSet(viewsets.ModelViewSet):
         Download the full design booklet including intro pages and all approved designs.
         Accepts a comma-separated list of design_ids in the query string.
         Example: /api/designs/download_booklet/?design_ids=1,2,3
+        The booklet of all approved designs (?all=1) or of one material (?material=<id>)
+        is served from the incrementally maintained master booklet. While that is being
+        built in the background, ?all=1 gets 429 with Retry-After and a material's
+        booklet is rendered like any selection.
         """
         try:
+            all_designs = request.query_params.get("all", "").lower() in ["1", "true", "yes"]
+            material = request.query_params.get("material")
+            if all_designs or material:
+                return self.master_booklet_response(request, material)
+
             design_ids_param = request.query_params.get("design_ids", "")
-            design_ids = [int(id.strip()) for id in design_ids_param.split(",") if id.strip().isdigit()]
+            design_ids = parse_design_ids(design_ids_param)
 
             if not design_ids:
                 return Response({"error": "No valid design IDs provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-            booklet_stream = generate_booklet(design_ids)
-
-            response = FileResponse(
-                booklet_stream,
-                as_attachment=True,
-                filename="not_a_house_but_a_home.pdf",
-                content_type="application/pdf",
+            approved_ids = list(
+                Design.objects.filter(id__in=design_ids, status="approved").values_list("id", flat=True)
             )
-            return response
+            return booklet_response(request, cached_booklet(approved_ids, generate_booklet))
 
+        except BookletBusy as e:
+            return busy_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def master_booklet_response(self, request, material=None):
+        master_booklet = get_master_booklet()
+
+        if material is None:
+            try:
+                master_file, incomplete_ids = master_booklet.open()
+            except MasterBookletNotReady as e:
+                schedule_master_build()
+                raise BookletBusy(str(e), settings.BOOKLET_RETRY_AFTER)
+            if incomplete_ids:
+                # Retry the designs whose file could not be downloaded while building
+                schedule_design_refresh(incomplete_ids)
+            return booklet_response(request, master_file)
+
+        if not material.isdigit():
+            return Response({"error": "Invalid material."}, status=status.HTTP_400_BAD_REQUEST)
+        approved_ids = list(
+            Design.objects.filter(material_id=material, status="approved").values_list("id", flat=True)
+        )
+
+        def build(approved_ids, **kwargs):
+            try:
+                return master_booklet.extract(approved_ids, **kwargs)
+            except MasterBookletNotReady:
+                schedule_master_build()
+                return generate_booklet(approved_ids, **kwargs)
+
+        return booklet_response(request, cached_booklet(approved_ids, build))
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def booklet_stats(self, request):
+        """
+        Booklet and design file cache counters, Cloudinary circuit breaker states,
+        download latency histograms, render admission counters and response cache
+        hits and misses per endpoint of the worker process that serves the request.
+        """
+        return Response({
+            "booklet_cache": get_booklet_cache().stats(),
+            "design_file_cache": get_design_file_cache().stats(),
+            "remote_fetch": fetch_stats(),
+            "renders": render_limit_stats(),
+            "response_cache": get_response_cache().stats(),
+        })
+
+
+# Booklet jobs (render large booklets in the background and poll for the result)
+class BookletJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = BookletJob.objects.all()
+    serializer_class = BookletJobSerializer
+
+    def create(self, request, *args, **kwargs):
+        """
+        Queue a booklet for a selection of designs and return the job to poll.
+        Accepts design_ids as a list or a comma-separated string.
+        Identical selections that are still queued or running share one job.
+        """
+        design_ids = parse_design_ids(request.data.get("design_ids", ""))
+        if not design_ids:
+            return Response({"error": "No valid design IDs provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        job, _ = submit_booklet_job(design_ids)
+        serializer = self.get_serializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """Download the booklet of a finished job."""
+        job = self.get_object()
+
+        if job.status != "done":
+            return Response(
+                {"error": "The booklet is not ready yet.", "status": job.status},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            booklet_file = open(job.file_path, "rb")
+        except FileNotFoundError:
+            return Response(
+                {"error": "The booklet has expired, please request it again."},
+                status=status.HTTP_410_GONE,
+            )
+
+        return booklet_response(request, booklet_file)
+
 
 def view_site_redirect(request):
     """Redirect to the appropriate frontend URL"""